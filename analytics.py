@@ -0,0 +1,157 @@
+# ===== 体重のトレンド（移動平均・EWMA・週あたり変化・目標到達予測）=====
+import threading
+
+import numpy as np
+import pandas as pd
+
+MA_WINDOWS = {"ma7": "7D", "ma30": "30D"}
+TREND_HALFLIFE_DAYS = 7      # EWMA（トレンド体重）の半減期
+SLOPE_LOOKBACK_DAYS = 28     # 週あたり変化は直近この日数の回帰直線から
+GOAL_MAX_DAYS = 3 * 365      # これより先になる予測は出さない
+
+def daily_weights(series: pd.DataFrame) -> pd.Series:
+    """1 ユーザーの記録 → 日付ごとの平均体重（同じ日に複数あれば平均）。"""
+    return series.groupby("date")["weight"].mean().astype(float)
+
+def _decay(dt_days):
+    return 0.5 ** (np.asarray(dt_days, dtype=float) / TREND_HALFLIFE_DAYS)
+
+def _days(index) -> np.ndarray:
+    return index.to_numpy(dtype="datetime64[s]").astype(float) / 86400.0
+
+class UserTrend:
+    """1 ユーザー分の日次系列と指標。
+    後ろの日付に行が増えただけなら extend() で増えた日の分だけ計算する。
+    EWMA は pandas の ewm(halflife, times, adjust=True) と同じ値を、分子・分母の状態として持つ。"""
+
+    def __init__(self, series: pd.DataFrame):
+        self.n_rows = 0
+        self.frame = pd.DataFrame(columns=["weight", *MA_WINDOWS, "trend"], dtype=float)
+        self._num = self._den = 0.0
+        self._rebuild(series)
+
+    def _rebuild(self, series: pd.DataFrame):
+        daily = daily_weights(series)
+        out = pd.DataFrame({"weight": daily})
+        for col, win in MA_WINDOWS.items():
+            out[col] = daily.rolling(win).mean()
+        if len(daily):
+            t = _days(daily.index)
+            w = _decay(t[-1] - t)
+            self._num, self._den = float((w * daily.to_numpy()).sum()), float(w.sum())
+            out["trend"] = daily.ewm(halflife=pd.Timedelta(days=TREND_HALFLIFE_DAYS),
+                                     times=daily.index).mean()
+        else:
+            out["trend"] = pd.Series(dtype=float)
+        self.frame = out
+        self._mark(series)
+
+    def _mark(self, series: pd.DataFrame):
+        self.n_rows = len(series)
+        self._check = (float(series["weight"].sum()), series["date"].iloc[-1] if len(series) else None)
+
+    def matches_prefix(self, series: pd.DataFrame) -> bool:
+        """series の先頭 n_rows 行が前回と同じか（途中の修正・削除が無いか）。"""
+        n = self.n_rows
+        if len(series) < n:
+            return False
+        if n == 0:
+            return True
+        head = series.iloc[:n]
+        return (head["date"].iloc[-1] == self._check[1]
+                and np.isclose(float(head["weight"].sum()), self._check[0]))
+
+    def extend(self, series: pd.DataFrame):
+        """series は前回分＋追加分。追加分が最終日より後だけなら差分計算、そうでなければ作り直す。"""
+        new = series.iloc[self.n_rows:]
+        if new.empty:
+            return
+        if len(self.frame) and new["date"].min() <= self.frame.index[-1]:
+            self._rebuild(series)
+            return
+        new_daily = daily_weights(new)
+        # 移動平均：最長の窓ぶんだけ過去を付けて計算し、新しい日だけ採る
+        ctx_start = new_daily.index[0] - pd.Timedelta(days=30)
+        ctx = pd.concat([self.frame["weight"][self.frame.index >= ctx_start], new_daily])
+        add = pd.DataFrame({"weight": new_daily})
+        for col, win in MA_WINDOWS.items():
+            add[col] = ctx.rolling(win).mean().loc[new_daily.index]
+        # EWMA：前回の状態から新しい日だけ漸化式で進める
+        trend = []
+        prev_t = _days(self.frame.index[-1:])[0] if len(self.frame) else None
+        num, den = self._num, self._den
+        for t, x in zip(_days(new_daily.index), new_daily.to_numpy()):
+            d = _decay(t - prev_t) if prev_t is not None else 0.0
+            num, den = num * d + x, den * d + 1.0
+            trend.append(num / den)
+            prev_t = t
+        self._num, self._den = num, den
+        add["trend"] = trend
+        self.frame = pd.concat([self.frame, add]) if len(self.frame) else add
+        self._mark(series)
+
+    def weekly_change(self) -> float:
+        """直近 SLOPE_LOOKBACK_DAYS 日の日次体重の回帰直線の傾き（kg/週）。2 日未満なら NaN。"""
+        f = self.frame
+        if f.empty:
+            return np.nan
+        recent = f[f.index >= f.index[-1] - pd.Timedelta(days=SLOPE_LOOKBACK_DAYS)]
+        if len(recent) < 2:
+            return np.nan
+        slope_per_day = np.polyfit(_days(recent.index), recent["weight"].to_numpy(), 1)[0]
+        return float(slope_per_day * 7)
+
+    def goal_date(self, goal_kg):
+        """今のペースで goal_kg に届く日（遠ざかっている・遠すぎるなら None）。"""
+        if self.frame.empty or goal_kg is None or pd.isna(goal_kg) or goal_kg <= 0:
+            return None
+        rate = self.weekly_change() / 7
+        gap = float(goal_kg) - float(self.frame["trend"].iloc[-1])
+        if abs(gap) < 0.05:
+            return self.frame.index[-1].date()
+        if not np.isfinite(rate) or rate == 0 or np.sign(rate) != np.sign(gap):
+            return None
+        days = gap / rate
+        if days > GOAL_MAX_DAYS:
+            return None
+        return (self.frame.index[-1] + pd.Timedelta(days=float(np.ceil(days)))).date()
+
+    def summary(self, goal_kg=None) -> dict:
+        if self.frame.empty:
+            return {}
+        last = self.frame.iloc[-1]
+        return {
+            "最新日": self.frame.index[-1].date(),
+            "体重(kg)": last["weight"],
+            "トレンド(kg)": last["trend"],
+            "7日平均": last["ma7"],
+            "30日平均": last["ma30"],
+            "週あたり(kg)": self.weekly_change(),
+            "目標(kg)": goal_kg if goal_kg is not None and pd.notna(goal_kg) and goal_kg > 0 else np.nan,
+            "到達予測日": self.goal_date(goal_kg),
+        }
+
+class TrendStore:
+    """ユーザーごとの UserTrend をプロセス内で持ち回る。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trends: dict = {}
+
+    def get(self, user_id: str, series: pd.DataFrame) -> UserTrend:
+        with self.lock:
+            tr = self.trends.get(user_id)
+            if tr is None or not tr.matches_prefix(series):
+                tr = self.trends[user_id] = UserTrend(series)
+            elif len(series) > tr.n_rows:
+                tr.extend(series)
+            return tr
+
+def summary_table(store: TrendStore, widx, dfu: pd.DataFrame) -> pd.DataFrame:
+    """全員分のトレンド要約（goal_kg 列が users にあれば到達予測も）。"""
+    goals = dfu.drop_duplicates("user_id").set_index("user_id").get("goal_kg")
+    rows = []
+    for uid in widx.series:
+        goal = pd.to_numeric(goals.get(uid), errors="coerce") if goals is not None else None
+        rows.append({"user": uid, **store.get(uid, widx.user(uid)).summary(goal)})
+    return pd.DataFrame(rows)
@@ -1,20 +1,28 @@
+# ===== 起動時間の計測（最初に実行）=====
+import time
+_T0 = time.perf_counter()
+import metrics
+metrics.begin_run()
+
 # ===== favicon 強制セット（最上部で実行）=====
-from PIL import Image
-import base64, time
+import base64, logging, os
 import streamlit as st
 
+log = logging.getLogger("weight_tracker")
+
 st.set_page_config(
     page_title="Weight-Trakcer",
-    page_icon=Image.open("favicon.png"),   # リポジトリ直下の favicon.png
+    page_icon="favicon.png",   # リポジトリ直下の favicon.png
     layout="centered",
 )
 
-def force_favicon(png_path: str):
+@st.cache_resource
+def favicon_html(png_path: str) -> str:
+    # base64 化はプロセスで 1 回。ver はファイル更新時刻（変わったときだけ URL が変わる）
     with open(png_path, "rb") as f:
         b64 = base64.b64encode(f.read()).decode("utf-8")
-    ver = int(time.time())
-    st.markdown(
-        f"""
+    ver = int(os.path.getmtime(png_path))
+    return f"""
         <link rel="icon" type="image/png" href="data:image/png;base64,{b64}?v={ver}">
         <link rel="apple-touch-icon" href="data:image/png;base64,{b64}?v={ver}">
         <script>
@@ -34,20 +42,27 @@ def force_favicon(png_path: str):
           setLink('apple-touch-icon');
         }})();
         </script>
-        """,
-        unsafe_allow_html=True,
-    )
+        """
+
+def force_favicon(png_path: str):
+    st.markdown(favicon_html(png_path), unsafe_allow_html=True)
 
 force_favicon("favicon.png")
 
 # ===== ここから通常のアプリ本体 =====
+# plotly / bcrypt / gspread は使う関数の中で読み込む（ログイン画面の初回表示を軽く）
 import pandas as pd
-import plotly.express as px
-import bcrypt
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import analytics
+import auth
+import charts
+import frames
+import storage
+import tenants
+import transfer
+from storage import normalize_uid
 from datetime import date, datetime
-from dateutil.relativedelta import relativedelta
+
+_IMPORTS_SEC = time.perf_counter() - _T0
 
 # --------------------------------
 # CSS（カード/余白/モバイル調整）
@@ -105,122 +120,255 @@ h3 { font-size: 1.0rem; margin-bottom: .4rem; }
 """, unsafe_allow_html=True)
 
 # --------------------------------
-# Secrets
+# Secrets / ストレージ
 # --------------------------------
-svc_json = st.secrets["GSPREAD_SERVICE_ACCOUNT_JSON"]
-SPREADSHEET_URL = st.secrets["SPREADSHEET_URL"]
 ADMIN_CODE = st.secrets.get("ADMIN_CODE", "satomi12345")
+# グラフ 1 枚あたりの描画点数の上限（既定はグラフ幅 704px に 2px/点）
+CHART_MAX_POINTS = int(st.secrets.get("CHART_MAX_POINTS", 704 // 2))
 
-# --------------------------------
-# Google Sheets
-# --------------------------------
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-credentials = ServiceAccountCredentials.from_json_keyfile_dict(svc_json, scope)
-gc = gspread.authorize(credentials)
-sh = gc.open_by_url(SPREADSHEET_URL)
-users_ws = sh.worksheet("users")
-weights_ws = sh.worksheet("weights")
+@st.cache_resource
+def tenant_pool() -> tenants.TenantPool:
+    # グループ（テナント）ごとのバックエンドとキャッシュ。[tenants.<key>] で SPREADSHEET_URL などを上書き
+    return tenants.TenantPool(st.secrets,
+                              max_active=int(st.secrets.get("TENANT_MAX_ACTIVE", tenants.TENANT_MAX_ACTIVE)),
+                              max_mb=float(st.secrets.get("TENANT_MAX_MB", tenants.TENANT_MAX_MB)))
+
+def tenant_key() -> str:
+    return st.session_state.get("tenant", "")
+
+def tenant() -> tenants.Tenant:
+    return tenant_pool().get(tenant_key())
+
+def backend() -> storage.StorageBackend:
+    # STORAGE_BACKEND / SQLITE_PATH / GSPREAD_SERVICE_ACCOUNT_JSON / SPREADSHEET_URL
+    return tenant().backend
+
+@st.cache_resource
+def metrics_server():
+    # METRICS_PORT があれば Prometheus 形式の /metrics をそのポートで出す
+    port = st.secrets.get("METRICS_PORT")
+    return metrics.serve(int(port)) if port else None
+
+metrics_server()
 
 # --------------------------------
 # Utils
 # --------------------------------
-def normalize_uid(s: str) -> str:
-    return str(s).replace("\u3000"," ").replace("\n"," ").replace("\r"," ").strip()
+def users_cache() -> storage.DatasetCache:
+    return tenant().users
 
-@st.cache_data(ttl=60)
+def weights_cache() -> storage.DatasetCache:
+    return tenant().weights
+
+# 返り値はプロセス共有（読み取り専用。書き換えるときは copy してから）
 def df_users() -> pd.DataFrame:
-    u = pd.DataFrame(users_ws.get_all_records())
-    if u.empty:
-        return pd.DataFrame(columns=["user_id","password_hash","plain_password","height_cm"])
-    # 互換: plain_password 無い既存表でも列を用意しておく
-    if "plain_password" not in u.columns:
-        u["plain_password"] = ""
-    if "height_cm" not in u.columns:
-        u["height_cm"] = None
-    u["user_id"] = u["user_id"].map(normalize_uid)
-    # 数値
-    u["height_cm"] = pd.to_numeric(u["height_cm"], errors="coerce")
-    return u
-
-@st.cache_data(ttl=30)
+    return users_cache().get()
+
 def df_weights() -> pd.DataFrame:
-    df = pd.DataFrame(weights_ws.get_all_records())
-    if df.empty:
-        return df
-    df["user_id"] = df["user_id"].map(normalize_uid)
-    df["date"] = pd.to_datetime(
-        df["year"].astype(str) + "-" +
-        df["month"].astype(str).str.zfill(2) + "-" +
-        df["day"].astype(str).str.zfill(2),
-        errors="coerce"
-    )
-    df["weight"] = pd.to_numeric(df["weight"], errors="coerce")
-    return df.dropna(subset=["date","weight"]).sort_values("date")
-
-def filter_period(dfx: pd.DataFrame, key: str) -> pd.DataFrame:
-    if dfx.empty: return dfx
-    today = pd.Timestamp.today().normalize()
-    if key == "1か月":
-        since = today - relativedelta(months=1)
-    elif key == "3か月":
-        since = today - relativedelta(months=3)
-    else:
-        since = dfx["date"].min()
-    return dfx[dfx["date"] >= since].sort_values("date")
+    return weights_cache().get()
+
+# 版を見るだけの呼び出しは命中率に数えない（表を使う df_users / df_weights だけ数える）
+def users_version() -> int:
+    users_cache().get(count=False)
+    return users_cache().version
+
+def weights_version() -> int:
+    weights_cache().get(count=False)
+    return weights_cache().version
+
+# 版ごとの派生データはテナントごとに持つ（tenant().memo。グループを手放すときに一緒に捨て、メモリ量にも数える）
+# 返り値は共有（読み取り専用）
+def weights_index() -> frames.WeightIndex:
+    # weights の版が変わったときだけ組み直す
+    v = weights_version()
+    return tenant().memo("weights_index", v, lambda: frames.WeightIndex(df_weights(), v))
+
+def latest_table(users_version: int, weights_version: int) -> pd.DataFrame:
+    # バージョン印が変わったときだけ組み直す
+    return tenant().memo("latest_table", (users_version, weights_version),
+                         lambda: frames.latest_table(df_users(), weights_index().latest))
+
+def trend_store() -> analytics.TrendStore:
+    return tenant().trends
+
+def user_trend(user_id: str) -> analytics.UserTrend:
+    # 前回から後ろの日付に増えた分だけ計算する（途中が変わったときだけ作り直し）
+    return trend_store().get(user_id, weights_index().user(user_id))
+
+ADMIN_PAGE_SIZE = 50   # 管理者画面の一覧 1 ページあたりの件数
+
+def user_index() -> frames.UserIndex:
+    # 並べ替え済みの ID 一覧は users の版ごとに 1 回だけ作る
+    return tenant().memo("user_index", users_version(), lambda: frames.UserIndex(df_users()["user_id"]))
+
+def latest_order(users_version: int, weights_version: int, column: str, ascending: bool):
+    # 並べ替えはサーバー側で 1 回（ページ送りでは並べ直さない）
+    return tenant().memo("latest_order", (users_version, weights_version, column, ascending),
+                         lambda: frames.sort_positions(latest_table(users_version, weights_version), column, ascending),
+                         keep=8)
+
+def pager(n: int, key: str):
+    # ページ番号の入力と「n 件中 a–b 件目」を描き、表示する範囲 (start, end) を返す
+    n_pages = frames.page_bounds(n, 1, ADMIN_PAGE_SIZE)[2]
+    if st.session_state.get(key, 1) > n_pages:
+        st.session_state[key] = n_pages   # 絞り込みでページ数が減ったとき
+    page = st.number_input(f"ページ（全 {n_pages}）", min_value=1, max_value=n_pages,
+                           step=1, key=key) if n_pages > 1 else 1
+    start, end, _ = frames.page_bounds(n, page, ADMIN_PAGE_SIZE)
+    st.caption(f"{n} 件中 {start + 1 if n else 0}–{end} 件目")
+    return start, end
+
+def trend_summary(users_version: int, weights_version: int) -> pd.DataFrame:
+    def build():
+        t = analytics.summary_table(trend_store(), weights_index(), df_users())
+        return t.round({"体重(kg)": 1, "トレンド(kg)": 1, "7日平均": 1, "30日平均": 1, "週あたり(kg)": 2})
+    return tenant().memo("trend_summary", (users_version, weights_version), build)
+
+def trend_order(users_version: int, weights_version: int, column: str, ascending: bool):
+    return tenant().memo("trend_order", (users_version, weights_version, column, ascending),
+                         lambda: frames.sort_positions(trend_summary(users_version, weights_version), column, ascending),
+                         keep=8)
+
+def weight_aggregates() -> frames.WeightAggregates:
+    return tenant().aggregates
+
+def aggregates() -> frames.WeightAggregates:
+    # weights の版が変わったとき（TTL の読み直しなど）だけ作り直す。自分の書き込みは patch_weights で足し込む
+    agg = weight_aggregates()
+    agg.sync(df_weights(), weights_version())
+    return agg
+
+FIGURE_MEMO_ENTRIES = 64   # テナントごとに覚えておく図の数
+
+@metrics.timed("figure")
+def _build_figure_json(kind: str, user_id: str, period_key: str) -> str:
+    if kind == "all":
+        return charts.all_figure_json(df_weights(), aggregates(), period_key, CHART_MAX_POINTS)
+    return charts.user_figure_json(weights_index().user(user_id), user_trend(user_id), user_id, period_key,
+                                   CHART_MAX_POINTS, font_size=12 if kind == "admin_user" else 13)
+
+def weight_figure_json(kind: str, user_id: str, period_key: str, weights_version: int, today: date) -> str:
+    # (user, 期間, データ版, 日付) が同じ間は filter_period〜px.line を丸ごと省き、JSON を返す
+    # kind: "user"（本人）/ "admin_user"（管理者の個別データ）/ "all"（全員）。データ無しは ""
+    return tenant().memo("figure", (kind, user_id, period_key, weights_version, today),
+                         lambda: _build_figure_json(kind, user_id, period_key), keep=FIGURE_MEMO_ENTRIES)
+
+@metrics.timed("chart_render")
+def show_figure(fig_json: str):
+    import plotly.io as pio
+    st.plotly_chart(pio.from_json(fig_json), use_container_width=True,
+                    config={"staticPlot": True, "displayModeBar": False})
+
+def password_index() -> dict:
+    # user_id → password_hash（同じ ID が複数あれば先頭の行）。users の版ごとに 1 回だけ作る
+    def build():
+        u = df_users().drop_duplicates("user_id")
+        return dict(zip(u["user_id"], u["password_hash"].astype(str)))
+    return tenant().memo("password_index", users_version(), build)
+
+@st.cache_resource
+def login_throttle() -> auth.LoginThrottle:
+    return auth.LoginThrottle()
 
 def verify_user(user_id: str, plain_password: str) -> bool:
-    u = df_users()
-    if u.empty: return False
     user_id = normalize_uid(user_id)
-    row = u[u["user_id"] == user_id]
-    if row.empty: return False
-    hashed = str(row.iloc[0].get("password_hash", ""))
+    hashed = password_index().get(user_id, "")
     if not hashed: return False
-    try:
-        return bcrypt.checkpw(plain_password.encode("utf-8"), hashed.encode("utf-8"))
-    except Exception:
-        return False
+    # bcrypt はプール側で（同時ログインが多くても CPU 数までに抑える）
+    return auth.check_password_async(plain_password, hashed).result()
+
+# --------------------------------
+# 書き込み状況（シートへの保存はバックグラウンド。完了/失敗をここで知らせる）
+# --------------------------------
+WRITE_STATUS_POLL_SEC = 2
+
+def track_write(label: str, fut, cache: storage.DatasetCache):
+    # 失敗したら差し込んだ分を捨てて読み直す
+    fut.add_done_callback(lambda f: f.exception() is not None and cache.invalidate())
+    pending = [w for w in st.session_state.writes if not w[1].done()]
+    st.session_state.writes = pending + [(label, fut)]
+
+def _write_status_body():
+    sync = backend().sync_status()
+    offline = bool(sync and sync["error"] is not None)
+    if sync and sync["pending"] and offline:
+        st.warning(f"📴 シートにつながりません。{sync['pending']} 件はこの端末に保存済みで、"
+                   "つながり次第自動で送ります。")
+    for label, fut in st.session_state.writes:
+        if not fut.done():
+            st.caption(f"{'📥 送信待ち' if offline else '⏳ シートへ保存中'}：{label}")
+        elif fut.exception() is not None:
+            st.warning(f"保存に失敗しました：{label}（{fut.exception()}）")
+        else:
+            st.caption(f"✅ 保存済み：{label}")
+
+@st.fragment(run_every=WRITE_STATUS_POLL_SEC)
+def _write_status_poll():
+    _write_status_body()
+    if all(f.done() for _, f in st.session_state.writes):
+        st.rerun()   # 全部終わったら通常表示へ（ポーリング停止）
+
+def write_status():
+    if any(not f.done() for _, f in st.session_state.writes):
+        _write_status_poll()
+    else:
+        _write_status_body()
+        # 成功は 1 度見せたら消す（失敗は次の書き込みまで残す）
+        st.session_state.writes = [w for w in st.session_state.writes if w[1].exception() is not None]
+
+# --------------------------------
+# 他のセッションの書き込み・シートの変更を画面に反映（データの版が変わったら再実行）
+# --------------------------------
+# 同じプロセスの書き込みは共有キャッシュに差し込み済み（版がすぐ変わる）。外部の編集は
+# バックエンドの revision（シートごとの行数など）を DATA_POLL_SEC ごとに確かめて拾う
+DATA_POLL_SEC = float(st.secrets.get("DATA_POLL_SEC", tenants.DATA_POLL_SEC))
+
+def data_versions() -> tuple:
+    return (users_version(), weights_version())
+
+@st.fragment(run_every=DATA_POLL_SEC)
+def live_updates():
+    if data_versions() != st.session_state.get("seen_versions"):
+        st.rerun()
 
 def create_user(user_id: str, plain_password: str, height_cm_input: str):
-    st.cache_data.clear()
+    users_cache().invalidate()   # 重複チェックは最新の users で
     user_id = normalize_uid(user_id)
     if not user_id or not plain_password:
         return "user_id と password を入力してください。"
     u = df_users()
     if not u.empty and any(u["user_id"] == user_id):
         return "その user_id は既に存在します。"
-    hashed = bcrypt.hashpw(plain_password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    hashed = auth.hash_password(plain_password)
     try:
         h = float(height_cm_input) if height_cm_input not in [None, "", " "] else ""
     except:
         h = ""
-    headers = users_ws.row_values(1)
-    row = []
-    for hname in headers:
-        if hname == "user_id": row.append(user_id)
-        elif hname == "password_hash": row.append(hashed)
-        elif hname == "plain_password": row.append(plain_password)   # ← 追加保存
-        elif hname == "height_cm": row.append(h if h != "" else "")
-        else: row.append("")
-    users_ws.append_row(row)
+    record = {
+        "user_id": user_id,
+        "password_hash": hashed,
+        "plain_password": plain_password,   # ← 追加保存
+        "height_cm": h if h != "" else "",
+    }
+    track_write(f"ユーザー {user_id}", backend().append_user(record), users_cache())
+    users_cache().patch(lambda u: storage.normalize_users(
+        pd.concat([u, pd.DataFrame([record])], ignore_index=True)))
     return f"ユーザー {user_id} を作成しました。"
 
 def update_height(user_id: str, height_cm: float):
-    st.cache_data.clear()
     u = df_users()
     if u.empty: return "users シートが空です。"
-    idx = u.index[u["user_id"] == user_id]
-    if len(idx) == 0: return "ユーザーが見つかりません。"
-    r = idx[0] + 2
-    headers = users_ws.row_values(1)
-    if "height_cm" not in headers:
+    if not (u["user_id"] == user_id).any(): return "ユーザーが見つかりません。"
+    try:
+        fut = backend().update_user_field(user_id, "height_cm", str(height_cm))
+    except KeyError:
         return "users シートに height_cm ヘッダーがありません。"
-    c = headers.index("height_cm") + 1
-    users_ws.update_cell(r, c, str(height_cm))
+    track_write(f"身長 {float(height_cm):.1f}cm", fut, users_cache())
+    users_cache().patch(lambda u: u.assign(
+        height_cm=u["height_cm"].mask(u["user_id"] == user_id, float(height_cm))))
     return "身長を更新しました。"
 
 def add_weight_row(y: int, m: int, d: int, user_id: str, weight):
-    st.cache_data.clear()
     try:
         _ = datetime(year=int(y), month=int(m), day=int(d))
     except Exception:
@@ -232,9 +380,43 @@ def add_weight_row(y: int, m: int, d: int, user_id: str, weight):
     if not (30 <= w <= 200):
         return "体重は 30〜200 の範囲で入力してください。"
     user_id = normalize_uid(user_id)
-    weights_ws.append_row([int(y), int(m), int(d), user_id, w])
+    fut = backend().append_weight(int(y), int(m), int(d), user_id, w)
+    track_write(f"{y}-{int(m):02d}-{int(d):02d} {w:.1f}kg", fut, weights_cache())
+    # weights だけ、追加した 1 行を差し込む（users や他の表はそのまま）
+    new_row = storage.normalize_weights(pd.DataFrame(
+        [{"year": int(y), "month": int(m), "day": int(d), "user_id": user_id, "weight": w}]))
+    patch_weights(new_row)
     return f"追加: {y}-{int(m):02d}-{int(d):02d} / {user_id} / {w:.1f}kg"
 
+def patch_weights(add: pd.DataFrame):
+    # 手元の weights に正規化済みの行を差し込み、集計にも同じ行を足す
+    prev = weights_cache().version
+    weights_cache().patch(lambda dfw: frames.append_weights(dfw, add))
+    weight_aggregates().add(add, prev, weights_cache().version)
+
+IMPORT_BATCH_ROWS = 2000   # 1 回の書き込みで送る行数
+
+def import_weights(file, default_user: str, encoding: str):
+    # チャンクごとに検証 → 通った行をまとめて書き込み。(追加件数, 弾いた行) を返す
+    existing = set(transfer.weight_keys(df_weights()))
+    known = set(df_users()["user_id"])
+    bar = st.progress(0.0, text="インポート中…")
+    added, rejected, futs = 0, [], []
+    for chunk, done in transfer.iter_chunks(file, file.name, encoding=encoding):
+        valid, bad = transfer.validate_weights(chunk, existing, known, default_user)
+        rejected.append(bad)
+        rows = transfer.to_sheet_rows(valid)
+        for i in range(0, len(rows), IMPORT_BATCH_ROWS):
+            futs.append(backend().append_weights(rows[i:i + IMPORT_BATCH_ROWS]))
+        if not valid.empty:
+            patch_weights(valid)
+        added += len(valid)
+        bar.progress(done, text=f"インポート中… {added} 行")
+    bar.progress(1.0, text=f"読み込み完了：{added} 行")
+    if futs:
+        track_write(f"インポート {added} 行", storage.gather(futs), weights_cache())
+    return added, (pd.concat(rejected) if rejected else pd.DataFrame())
+
 def calc_bmi(weight_kg: float, height_cm) -> str:
     try:
         h = float(height_cm)
@@ -244,6 +426,22 @@ def calc_bmi(weight_kg: float, height_cm) -> str:
     except:
         return "未設定"
 
+# --------------------------------
+# 実行時間（起動の遅れを追えるように）
+# --------------------------------
+@st.cache_resource
+def run_times() -> dict:
+    return {"cold_ms": None, "imports_ms": None, "last_ms": None}
+
+def record_run_time(sec: float):
+    rt = run_times()
+    rt["last_ms"] = sec * 1000
+    metrics.end_run(sec, user=bool(st.session_state.get("current_user")),
+                    admin=bool(st.session_state.get("is_admin")))
+    if rt["cold_ms"] is None:
+        rt["cold_ms"], rt["imports_ms"] = sec * 1000, _IMPORTS_SEC * 1000
+        log.info("cold start: first run %.0f ms (imports %.0f ms)", rt["cold_ms"], rt["imports_ms"])
+
 # --------------------------------
 # 桁UI（各位セレクト → 実数へ）
 # --------------------------------
@@ -269,6 +467,8 @@ def init_weight_digits(val: float):
 def digits_to_float(hund, tens, ones, tenths):
     return float(100*hund + 10*tens + ones + tenths/10.0)
 
+metrics.lap("setup")
+
 # --------------------------------
 # 画面本体
 # --------------------------------
@@ -282,6 +482,24 @@ if "period_key" not in st.session_state:   st.session_state.period_key = "1か
 if "prev_user" not in st.session_state:    st.session_state.prev_user = None
 if "weight_input" not in st.session_state: st.session_state.weight_input = 65.0
 if "height_input" not in st.session_state: st.session_state.height_input = 170.0
+if "writes" not in st.session_state:       st.session_state.writes = []
+
+# グループ（URL の ?group=...。無ければ既定のシート）。切り替えたらログイン状態を持ち越さない
+group = st.query_params.get("group", "")
+if group not in tenant_pool().keys():
+    st.error("グループが見つかりません。URL を確認してください。")
+    st.stop()
+try:
+    tenant_pool().get(group)
+except ValueError as e:
+    st.error(f"このグループは設定が足りないため使えません。{e}")
+    st.stop()
+if st.session_state.get("tenant", "") != group:
+    st.session_state.tenant = group
+    st.session_state.current_user = None
+    st.session_state.is_admin = False
+    st.session_state.prev_user = None
+    st.session_state.writes = []
 
 # --- LOGIN ---
 st.subheader("LOGIN")
@@ -290,29 +508,43 @@ with st.container():
     uid = cA.text_input("ID")
     pw  = cB.text_input("PASSWORD", type="password")
     if st.button("ログイン"):
-        if verify_user(uid, pw):
+        # 同じ ID が別のグループにもありうるので、失敗回数はグループごとに数える
+        throttle_key = (tenant_key(), normalize_uid(uid))
+        wait = login_throttle().wait_sec(throttle_key)
+        if wait > 0:
+            st.error(f"ログイン失敗が続いたため、この ID はあと {int(wait // 60) + 1} 分ほど使えません。")
+        elif verify_user(uid, pw):
+            login_throttle().succeeded(throttle_key)
             st.session_state.current_user = normalize_uid(uid)
             st.success(f"ログイン成功：{st.session_state.current_user}")
         else:
+            login_throttle().failed(throttle_key)
             st.error("ログイン失敗")
 
+# シートへの保存状況（中身はページ末尾で描く：同じ実行内の書き込みも反映させるため）
+status_box = st.container()
+
 # ここで余白を追加
 st.markdown('<div class="vspace"></div>', unsafe_allow_html=True)
+metrics.lap("login")
 
 # --- USER AREA（ラジオで安定切替） ---
 if st.session_state.current_user:
-    dfw = df_weights()
+    widx = weights_index()
     du = df_users()
     me = st.session_state.current_user
     my_h = du.set_index("user_id").get("height_cm", pd.Series()).get(me, None)
 
     # 初回ログイン/切替時：最新値で初期化
     if st.session_state.prev_user != me:
-        me_df_sorted = dfw[dfw["user_id"] == me].sort_values("date")
-        if not me_df_sorted.empty:
-            st.session_state.weight_input = float(me_df_sorted.iloc[-1]["weight"])
+        me_last = widx.last(me)
+        if me_last is not None:
+            st.session_state.weight_input = float(me_last["weight"])
         if pd.notna(my_h):
             st.session_state.height_input = float(my_h)
+        # 目標体重は users に goal_kg 列があればその値から（無ければ未設定）
+        my_goal = pd.to_numeric(du.set_index("user_id").get("goal_kg", pd.Series()).get(me, None), errors="coerce")
+        st.session_state.goal_kg = float(my_goal) if pd.notna(my_goal) and my_goal > 0 else 0.0
         st.session_state.prev_user = me
 
     # メニュー
@@ -321,27 +553,36 @@ if st.session_state.current_user:
 
     # === 体重グラフ ===
     if user_tab == "体重グラフ":
-        me_df_sorted = dfw[dfw["user_id"] == me].sort_values("date")
-        dplot = filter_period(me_df_sorted, st.session_state.period_key)
-        if dplot.empty:
+        fig_json = weight_figure_json("user", me, st.session_state.period_key, widx.version, date.today())
+        if not fig_json:
             st.info("データがありません。")
         else:
-            fig = px.line(dplot, x="date", y="weight", markers=True,
-                          title=f"{me} の体重推移（{st.session_state.period_key}）",
-                          labels={"date":"日付","weight":"体重(kg)"})
-            fig.update_layout(margin=dict(l=8, r=8, t=48, b=8), font=dict(size=13))
-            st.plotly_chart(fig, use_container_width=True,
-                            config={"staticPlot": True, "displayModeBar": False})
+            show_figure(fig_json)
         # 期間切替（返り値で保持）
         st.session_state.period_key = st.radio("表示期間", ["1か月", "3か月", "全期間"], horizontal=True)
 
+        # 目標体重と到達予測（直近 4 週のペースで直線延長）
+        tr = user_trend(me)
+        if not tr.frame.empty:
+            # ウィジェットの key にすると他のタブを開いたときに消えるので、返り値で保持（期間と同じ）
+            goal = st.number_input("目標体重(kg)（0 で未設定）", min_value=0.0, max_value=200.0,
+                                   value=st.session_state.goal_kg, step=0.1, format="%.1f")
+            st.session_state.goal_kg = goal
+            rate = tr.weekly_change()
+            pace = "—" if pd.isna(rate) else f"{rate:+.2f} kg/週"
+            if goal > 0:
+                eta = tr.goal_date(goal)
+                st.caption(f"現在のペース：{pace} ／ 目標 {goal:.1f}kg 到達予測："
+                           + (f"{eta}" if eta else "このペースでは見込めません"))
+            else:
+                st.caption(f"現在のペース：{pace}")
+
     # === 最新の記録（BMI） ===
     elif user_tab == "最新の記録（BMI）":
-        me_df_sorted = dfw[dfw["user_id"] == me].sort_values("date")
-        if me_df_sorted.empty:
+        last = widx.last(me)
+        if last is None:
             st.info("記録がありません。")
         else:
-            last = me_df_sorted.iloc[-1]
             last_w = float(last["weight"])
             base_h = float(my_h) if pd.notna(my_h) else st.session_state.height_input
             bmi_txt = calc_bmi(last_w, base_h)
@@ -350,6 +591,11 @@ if st.session_state.current_user:
             c1.metric("最新日", f"{last['date'].date()}")
             c2.metric("体重", f"{last_w:.1f} kg")
             c3.metric("BMI", bmi_txt)
+            sm = user_trend(me).summary()
+            c4, c5, c6 = st.columns(3)
+            c4.metric("トレンド", f"{sm['トレンド(kg)']:.1f} kg")
+            c5.metric("7日平均", "—" if pd.isna(sm["7日平均"]) else f"{sm['7日平均']:.1f} kg")
+            c6.metric("週あたり", "—" if pd.isna(sm["週あたり(kg)"]) else f"{sm['週あたり(kg)']:+.2f} kg")
             st.markdown('</div>', unsafe_allow_html=True)
 
     # === 記録を追加（体重：□ □ □ . □ kg） ===
@@ -401,6 +647,8 @@ if st.session_state.current_user:
             st.session_state.height_input = height_val
         st.markdown('</div>', unsafe_allow_html=True)
 
+metrics.lap("user_area")
+
 # ===== 管理者エリアの前に半ページ分の余白 =====
 st.markdown('<div class="hr-space"></div>', unsafe_allow_html=True)
 
@@ -411,10 +659,14 @@ st.subheader("Administrator")
 if "is_admin" not in st.session_state:
     st.session_state.is_admin = False
 
-if not st.session_state.is_admin:
+# グループの合言葉は [tenants.<key>] の ADMIN_CODE だけ（既定の合言葉は既定のグループ専用）
+admin_code = tenant().conf.get("ADMIN_CODE", ADMIN_CODE)
+if not admin_code:
+    st.caption("このグループでは管理者モードは使えません（ADMIN_CODE が未設定）。")
+elif not st.session_state.is_admin:
     code = st.text_input("ADNIN_CODE", type="password")
     if st.button("管理者モードに入る"):
-        if code == ADMIN_CODE:
+        if code == admin_code:
             st.session_state.is_admin = True
             st.success("管理者モードに入りました。")
         else:
@@ -422,41 +674,45 @@ if not st.session_state.is_admin:
 
 if st.session_state.is_admin:
     # 並び順：個別データ / 全員のグラフ / 全員の最新情報 / ユーザー追加
-    tabs_admin = st.tabs(["個別データ", "全員のグラフ", "全員の最新情報", "ユーザー追加"])
+    tabs_admin = st.tabs(["個別データ", "全員のグラフ", "全員の最新情報", "ユーザー追加", "一括インポート", "エクスポート", "診断"])
 
     # --- 個別データ ---
     with tabs_admin[0]:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         u = df_users()
-        w = df_weights()
-        user_list = sorted(u["user_id"].tolist()) if not u.empty else []
-        if len(user_list) == 0:
+        widx = weights_index()
+        uix = user_index()
+        page_ids = []
+        if len(uix.ids) == 0:
             st.info("users シートにユーザーがいません。")
         else:
+            # 検索で絞り込み、1 ページ分だけを選択肢にする
+            cq, cm = st.columns([3, 2])
+            q = cq.text_input("ユーザー検索（ID）", key="admin_user_q")
+            q_mode = cm.radio("検索方法", ["前方一致", "部分一致"], horizontal=True, key="admin_user_mode")
+            hits = uix.search(normalize_uid(q), "prefix" if q_mode == "前方一致" else "contains")
+            if len(hits) == 0:
+                st.info("該当するユーザーがいません。")
+            else:
+                start, end = pager(len(hits), "admin_user_page")
+                page_ids = hits[start:end].tolist()
+        if page_ids:
             colsel, colper = st.columns([2, 2])
-            sel_uid = colsel.selectbox("ユーザーを選択", user_list, key="admin_pick_user")
+            sel_uid = colsel.selectbox("ユーザーを選択", page_ids, key="admin_pick_user")
             period_k = colper.radio("表示期間", ["1か月","3か月","全期間"], horizontal=True, key="admin_pick_period")
 
             # グラフ
-            per_df = filter_period(w[w["user_id"] == sel_uid].sort_values("date"), period_k)
-            if per_df.empty:
+            fig_json = weight_figure_json("admin_user", sel_uid, period_k, widx.version, date.today())
+            if not fig_json:
                 st.info(f"{sel_uid} の {period_k} データがありません。")
             else:
-                fig_u = px.line(
-                    per_df, x="date", y="weight", markers=True,
-                    title=f"{sel_uid} の体重推移（{period_k}）",
-                    labels={"date":"日付","weight":"体重(kg)"}
-                )
-                fig_u.update_layout(margin=dict(l=8, r=8, t=48, b=8), font=dict(size=12))
-                st.plotly_chart(fig_u, use_container_width=True,
-                                config={"staticPlot": True, "displayModeBar": False})
+                show_figure(fig_json)
 
             # 最新情報（小さめ横一列カード）
-            w_u_all = w[w["user_id"] == sel_uid].sort_values("date")
-            if w_u_all.empty:
+            last = widx.last(sel_uid)
+            if last is None:
                 st.info("最新情報：体重記録がありません。")
             else:
-                last = w_u_all.iloc[-1]
                 try:
                     h = u.set_index("user_id").get("height_cm").get(sel_uid, None)
                 except KeyError:
@@ -485,46 +741,36 @@ if st.session_state.is_admin:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         period_all = st.radio("表示期間（全員）", ["1か月","3か月","全期間"],
                               horizontal=True, key="period_all")
-        dfw_all = filter_period(df_weights(), period_all)
-        if dfw_all.empty:
+        fig_json = weight_figure_json("all", "", period_all, weights_index().version, date.today())
+        if not fig_json:
             st.info("データがありません。")
         else:
-            fig_all = px.line(
-                dfw_all, x="date", y="weight", color="user_id", markers=True,
-                title=f"全員の体重推移（{period_all}）",
-                labels={"date":"日付","weight":"体重(kg)","user_id":"ユーザー"}
-            )
-            fig_all.update_layout(margin=dict(l=8, r=8, t=48, b=8), font=dict(size=13))
-            st.plotly_chart(fig_all, use_container_width=True,
-                            config={"staticPlot": True, "displayModeBar": False})
+            show_figure(fig_json)
         st.markdown('</div>', unsafe_allow_html=True)
 
     # --- 全員の最新情報（※ plain_password 表示） ---
     with tabs_admin[2]:
         st.markdown('<div class="card">', unsafe_allow_html=True)
-        u = df_users()
-        w = df_weights()
-        rows=[]
-        for uid_ in u["user_id"]:
-            w_u = w[w["user_id"] == uid_].sort_values("date")
-            if not w_u.empty:
-                last_w = float(w_u.iloc[-1]["weight"])
-                last_d = w_u.iloc[-1]["date"].date()
-            else:
-                last_w, last_d = None, None
-            h = u.set_index("user_id").get("height_cm").get(uid_, None)
-            pw_plain = u.set_index("user_id").get("plain_password").get(uid_, None)
-            bmi = calc_bmi(last_w, h) if last_w is not None and pd.notna(h) else "未"
-            rows.append([
-                uid_,
-                (pw_plain if pw_plain else "-"),   # 平文パスワード表示
-                last_d,
-                f"{last_w:.1f}" if last_w is not None else "-", 
-                f"{h:.1f}" if pd.notna(h) else "-", 
-                bmi
-            ])
-        df_latest = pd.DataFrame(rows, columns=["user", "password", "最新日", "体重(kg)", "身長(cm)", "BMI"])
-        st.dataframe(df_latest, use_container_width=True)
+        uv, wv = users_version(), weights_index().version
+        df_latest = latest_table(uv, wv)
+        cs, co = st.columns([3, 2])
+        sort_col = cs.selectbox("並べ替え", [c for c in df_latest.columns if c != "password"], key="latest_sort")
+        sort_asc = co.radio("順序", ["昇順", "降順"], horizontal=True, key="latest_order") == "昇順"
+        start, end = pager(len(df_latest), "latest_page")
+        order = latest_order(uv, wv, sort_col, sort_asc)
+        st.dataframe(df_latest.iloc[order[start:end]], use_container_width=True)
+        # トレンド（users に goal_kg 列があれば到達予測日も）。上の表と同じくサーバー側で並べてページ送り
+        st.markdown("**トレンド**")
+        df_trend = trend_summary(uv, wv)
+        if df_trend.empty:
+            st.info("データがありません。")
+        else:
+            ts, to = st.columns([3, 2])
+            trend_col = ts.selectbox("並べ替え", list(df_trend.columns), key="trend_sort")
+            trend_asc = to.radio("順序", ["昇順", "降順"], horizontal=True, key="trend_order") == "昇順"
+            t_start, t_end = pager(len(df_trend), "trend_page")
+            t_order = trend_order(uv, wv, trend_col, trend_asc)
+            st.dataframe(df_trend.iloc[t_order[t_start:t_end]], use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
     # --- ユーザー追加 ---
@@ -538,3 +784,110 @@ if st.session_state.is_admin:
         if st.button("ユーザー作成"):
             st.info(create_user(nu, npw, nh))
         st.markdown('</div>', unsafe_allow_html=True)
+
+    # --- 一括インポート ---
+    with tabs_admin[4]:
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("体重の履歴を CSV / Excel から一括登録します（列：user_id, year, month, day, weight ／ 日付は date 列でも可）")
+        up = st.file_uploader("ファイル（.csv / .xlsx）", type=["csv", "xlsx"], key="import_file")
+        ci1, ci2 = st.columns(2)
+        imp_uid = ci1.selectbox("user_id 列が無いときの登録先", [""] + user_index().ids.tolist(),
+                                key="import_user")
+        imp_enc = ci2.selectbox("文字コード（CSV）", ["utf-8-sig", "cp932"], key="import_enc")
+        if up is not None and st.button("インポート開始"):
+            try:
+                st.session_state.import_report = import_weights(up, imp_uid, imp_enc)
+            except (ValueError, UnicodeDecodeError) as e:
+                st.session_state.import_report = None
+                st.error(f"読み込めませんでした：{e}")
+        if st.session_state.get("import_report"):
+            added, rejected = st.session_state.import_report
+            st.success(f"{added} 行を追加しました。")
+            if not rejected.empty:
+                st.warning(f"{len(rejected)} 行は取り込みませんでした（理由は表の右端）。")
+                st.dataframe(rejected, use_container_width=True)
+                st.download_button("取り込めなかった行（CSV）", rejected.to_csv(index=False).encode("utf-8-sig"),
+                                   file_name="rejected.csv", mime="text/csv")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # --- エクスポート（分析用。パスワード列は含めない） ---
+    with tabs_admin[5]:
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("体重データ（user_id, 日付, 体重, 身長, BMI）を書き出します")
+        w_exp, u_exp = df_weights(), df_users()
+        ex_users = st.multiselect("ユーザー（未選択なら全員）", user_index().ids.tolist(), key="export_users")
+        if w_exp.empty:
+            st.info("データがありません。")
+        else:
+            d_min, d_max = w_exp["date"].min().date(), w_exp["date"].max().date()
+            ce1, ce2 = st.columns(2)
+            ex_range = ce1.date_input("期間", value=(d_min, d_max), key="export_range")
+            ex_fmt = ce2.radio("形式", ["CSV", "Parquet"], horizontal=True, key="export_fmt")
+            since, until = (list(ex_range) + [None, None])[:2]   # 片側だけ選択中でも動くように
+            fmt = ex_fmt.lower()
+            # クリックされたときに別スレッドで生成（キャッシュ済みの表を使い、シートは読まない）
+            st.download_button(
+                f"{ex_fmt} をダウンロード",
+                data=lambda: transfer.write_export(transfer.export_chunks(w_exp, u_exp, ex_users, since, until), fmt),
+                file_name=f"weights.{'parquet' if fmt == 'parquet' else 'csv'}",
+                mime="application/vnd.apache.parquet" if fmt == "parquet" else "text/csv",
+                key="export_download",
+            )
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    # --- 診断（実行時間・Sheets 呼び出し・キャッシュ命中率） ---
+    with tabs_admin[6]:
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        reg = metrics.REGISTRY
+        rt = run_times()
+        if rt["cold_ms"] is not None:
+            st.caption(f"コールドスタート {rt['cold_ms']:.0f} ms（import {rt['imports_ms']:.0f} ms）"
+                       f" ／ 前回の実行 {rt['last_ms']:.0f} ms")
+        if reg.runs:
+            last_run = reg.runs[-1]
+            st.markdown(f"**前回の実行の内訳**（計 {last_run['total_ms']:.0f} ms）")
+            st.dataframe(pd.DataFrame(list(last_run["stages_ms"].items()), columns=["stage", "ms"]),
+                         use_container_width=True, hide_index=True)
+        st.markdown("**段階ごとの累計**")
+        st.dataframe(pd.DataFrame(reg.stage_rows()).round(1), use_container_width=True, hide_index=True)
+        st.markdown("**Sheets API 呼び出し**")
+        calls = pd.DataFrame(reg.call_rows())
+        if calls.empty:
+            st.caption("まだありません（ローカル SQLite のみ、または未使用）。")
+        else:
+            st.dataframe(calls.round(2), use_container_width=True, hide_index=True)
+        st.markdown("**キャッシュ命中率**")
+        st.dataframe(pd.DataFrame(reg.cache_rows()).round(3), use_container_width=True, hide_index=True)
+        st.markdown("**グループ（最近使った順）**")
+        st.dataframe(pd.DataFrame(tenant_pool().stats()).round(2), use_container_width=True, hide_index=True)
+        sync = backend().sync_status()
+        if sync is not None:
+            st.markdown("**シートへの送信待ち（ジャーナル）**")
+            st.caption(f"未送信 {sync['pending']} 件"
+                       + (f" ／ 最後のエラー：{sync['error']}" if sync["error"] is not None else " ／ 接続中"))
+        if tenant().conf.get("STORAGE_BACKEND") == "fake":
+            # 障害の再現（メモリ上のシートを落とす・遅くする）
+            import fakesheet
+            sh = fakesheet.spreadsheet(tenant().conf.get("FAKE_SHEET", "default"))
+            sh.outage = st.toggle("シート障害を再現", value=sh.outage, key="fake_outage")
+            sh.latency = st.slider("シートの応答遅延（秒）", 0.0, 5.0, float(sh.latency), 0.1, key="fake_latency")
+        prom = reg.prometheus_text()
+        with st.expander("Prometheus 形式"):
+            st.code(prom, language="text")
+        st.download_button("metrics.txt", prom.encode("utf-8"), file_name="metrics.txt", mime="text/plain")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+metrics.lap("admin_area")
+
+# --- シートへの保存状況（ログイン欄の下の status_box に描く） ---
+with status_box:
+    write_status()
+metrics.lap("write_status")
+
+# --- データの更新待ち（ログイン中だけ。描いた時点の版を覚えておく） ---
+if st.session_state.current_user or st.session_state.is_admin:
+    st.session_state.seen_versions = data_versions()
+    live_updates()
+
+# --- 実行時間の記録（プロセス最初の 1 回＝コールドスタートはログに残す） ---
+record_run_time(time.perf_counter() - _T0)
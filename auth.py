@@ -0,0 +1,76 @@
+# ===== ログイン（bcrypt はスレッドプールで・ID ごとの試行回数制限）=====
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+LOGIN_MAX_FAILS = 5        # この回数失敗したら
+LOGIN_WINDOW_SEC = 300     # （この時間内に）
+LOGIN_LOCK_SEC = 300       # この間はその ID の照合をしない
+THROTTLE_MAX_IDS = 10_000  # 記録する ID 数の上限（古いものから捨てる）
+
+# bcrypt は GIL を離して計算するので、CPU 数までのスレッドで並べて捌く
+HASH_WORKERS = os.cpu_count() or 2
+_pool = None
+_pool_lock = threading.Lock()
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+        return _pool
+
+def check_password(plain_password: str, hashed: str) -> bool:
+    import bcrypt
+    try:
+        return bcrypt.checkpw(plain_password.encode("utf-8"), hashed.encode("utf-8"))
+    except Exception:
+        return False
+
+def check_password_async(plain_password: str, hashed: str) -> Future:
+    return _executor().submit(check_password, plain_password, hashed)
+
+def hash_password(plain_password: str) -> str:
+    import bcrypt
+    return _executor().submit(
+        lambda: bcrypt.hashpw(plain_password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    ).result()
+
+class LoginThrottle:
+    """ID（app ではグループと ID の組）ごとの失敗回数を数え、続いたら一定時間その ID の照合（＝ハッシュ計算）を止める。"""
+
+    def __init__(self, max_fails: int = LOGIN_MAX_FAILS, window: float = LOGIN_WINDOW_SEC,
+                 lock_sec: float = LOGIN_LOCK_SEC):
+        self.max_fails = max_fails
+        self.window = window
+        self.lock_sec = lock_sec
+        self.lock = threading.Lock()
+        self.fails: dict = {}           # キー → deque[失敗時刻]
+        self.locked_until: dict = {}    # キー → 解除時刻
+
+    def wait_sec(self, key) -> float:
+        """照合を止めている残り秒数（0 なら試してよい）。"""
+        with self.lock:
+            return max(0.0, self.locked_until.get(key, 0.0) - time.time())
+
+    def failed(self, key):
+        now = time.time()
+        with self.lock:
+            q = self.fails.pop(key, deque())
+            q.append(now)
+            while q and q[0] < now - self.window:
+                q.popleft()
+            self.fails[key] = q       # 末尾へ（dict の並び＝古い順）
+            if len(q) >= self.max_fails:
+                self.locked_until[key] = now + self.lock_sec
+                q.clear()
+            while len(self.fails) > THROTTLE_MAX_IDS:
+                self.fails.pop(next(iter(self.fails)))
+            for uid in [u for u, t in self.locked_until.items() if t < now]:
+                del self.locked_until[uid]
+
+    def succeeded(self, key):
+        with self.lock:
+            self.fails.pop(key, None)
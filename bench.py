@@ -0,0 +1,134 @@
+# ===== オフライン計測（合成データ × メモリ上のワークシート。ネットワーク・認証不要）=====
+# 使い方:
+#   python bench.py --users 10 100 1000 --years 1 5 --repeat 3
+#   python bench.py --users 100 --years 1 --csv before.csv    # 結果を保存して比較
+# 各段（シート読み込み → 索引 → 期間絞り込み → 最新表 → 集計 → トレンド → 図の JSON 化）の
+# 所要時間（最良 / 中央値）と、その段で確保したメモリのピーク（tracemalloc）を表にする。
+import argparse
+import gc
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import charts
+import frames
+from fakesheet import MemoryWorksheet
+from sheets import SheetsBackend, WeightsSync
+from storage import USER_COLUMNS, WEIGHT_COLUMNS
+
+CHART_MAX_POINTS = 704 // 2     # app.py の既定と同じ
+
+# --------------------------------
+# 合成データ（シートに書かれている形の行。先頭はヘッダー）
+# --------------------------------
+def synth_users(n_users: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    heights = np.round(rng.uniform(145, 190, n_users), 1)
+    return [USER_COLUMNS] + [[f"user{i:05d}", "", "", f"{h:.1f}"] for i, h in enumerate(heights)]
+
+def synth_weights(n_users: int, years: float, fill: float = 0.8, seed: int = 0,
+                  end: pd.Timestamp = None) -> list:
+    """ユーザーごとに日 1 回（記録率 fill）。シートへの追記順＝日付順に並べる。"""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.today().normalize() if end is None else end
+    days = pd.date_range(end=end, periods=max(int(365 * years), 1))
+    mask = rng.random((len(days), n_users)) < fill
+    d_idx, u_idx = np.nonzero(mask)                 # 行優先なので日付順
+    base = rng.uniform(50, 95, n_users)
+    drift = rng.normal(0, 0.01, n_users)             # kg/日
+    weight = np.round(base[u_idx] + drift[u_idx] * d_idx + rng.normal(0, 0.4, len(d_idx)), 1)
+    dd = days[d_idx]
+    return [WEIGHT_COLUMNS] + [
+        list(r) for r in zip(dd.year.astype(str), dd.month.astype(str), dd.day.astype(str),
+                             (f"user{i:05d}" for i in u_idx), weight.astype(str))
+    ]
+
+# --------------------------------
+# 計測
+# --------------------------------
+def measure(fn, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"best_ms": min(times), "median_ms": statistics.median(times), "peak_mb": peak / 2**20}
+
+def run_scale(n_users: int, years: float, repeat: int = 3, seed: int = 0) -> pd.DataFrame:
+    users_ws = MemoryWorksheet(synth_users(n_users, seed), "users")
+    weights_ws = MemoryWorksheet(synth_weights(n_users, years, seed=seed), "weights")
+    backend = SheetsBackend(users_ws, weights_ws)
+    sync = WeightsSync(weights_ws)
+    sync.refresh()
+    last = list(weights_ws.values[-1])
+
+    dfu = backend.users_frame()
+    dfw = WeightsSync(weights_ws).refresh()
+    idx = frames.WeightIndex(dfw)
+    uids = list(idx.series)
+    store = analytics.TrendStore()
+    agg = frames.WeightAggregates()
+    agg.sync(dfw, idx.version)
+
+    def delta():
+        weights_ws.append_rows([last])
+        sync.refresh()
+
+    def build_aggregates():
+        frames.WeightAggregates().sync(dfw, idx.version)
+
+    stages = [
+        ("users_frame", lambda: backend.users_frame()),
+        ("weights_frame（全件）", lambda: WeightsSync(weights_ws).refresh()),
+        ("weights_frame（差分 1 行）", delta),
+        ("WeightIndex", lambda: frames.WeightIndex(dfw)),
+        ("filter_period（全員・1か月）", lambda: [frames.filter_period(idx.user(u), "1か月") for u in uids]),
+        ("latest_table", lambda: frames.latest_table(dfu, idx.latest)),
+        ("WeightAggregates", build_aggregates),
+        ("トレンド要約（全員）", lambda: analytics.summary_table(analytics.TrendStore(), idx, dfu)),
+        # 図は app.weight_figure_json と同じ charts の関数で組み立てる
+        ("図（本人・全期間）", lambda: charts.user_figure_json(
+            idx.user(uids[0]), store.get(uids[0], idx.user(uids[0])), uids[0], "全期間", CHART_MAX_POINTS)),
+        ("図（全員・全期間）", lambda: charts.all_figure_json(dfw, agg, "全期間", CHART_MAX_POINTS)),
+    ]
+    rows = []
+    for name, fn in stages:
+        rows.append({"users": n_users, "years": years, "rows": len(dfw), "stage": name, **measure(fn, repeat)})
+    out = pd.DataFrame(rows)
+    out.attrs["calls"] = {"users": dict(users_ws.calls), "weights": dict(weights_ws.calls)}
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="データ処理・描画の各段をオフラインで計測する")
+    ap.add_argument("--users", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--years", type=float, nargs="+", default=[1])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--csv", help="結果を CSV に保存（前回分との比較用）")
+    args = ap.parse_args(argv)
+
+    results = []
+    for years in args.years:
+        for n in args.users:
+            r = run_scale(n, years, args.repeat, args.seed)
+            results.append(r)
+            print(f"\n== users={n} years={years:g} rows={r['rows'].iloc[0]:,} ==")
+            print(r[["stage", "best_ms", "median_ms", "peak_mb"]].to_string(index=False, float_format="%.2f"))
+            print("sheet calls:", r.attrs["calls"])
+    if args.csv:
+        pd.concat(results).to_csv(args.csv, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# ===== グラフの組み立て（Streamlit 非依存。app.py と bench.py で共用）=====
+# plotly は使う関数の中で読み込む（ログイン画面の初回表示を軽く）
+import pandas as pd
+
+import analytics
+import frames
+
+CHART_MIN_POINTS_PER_TRACE = 20
+
+AGG_LEVEL_DAYS = {"day": 1, "week": 7, "month": 30}
+AGG_LEVEL_LABEL = {"day": "日", "week": "週", "month": "月"}
+
+TREND_LINES = [("ma7", "7日平均", "dot"), ("ma30", "30日平均", "dash"), ("trend", "トレンド", "solid")]
+
+def agg_level(dfw: pd.DataFrame, period_key: str, n_users: int, max_points: int) -> str:
+    # 1 ユーザーあたりの点数が描画上限に収まる、いちばん細かい粒度
+    since = frames.period_start(period_key)
+    start = dfw["date"].min() if since is None else since
+    span_days = max((dfw["date"].max() - start).days + 1, 1)
+    cap = max(CHART_MIN_POINTS_PER_TRACE, max_points // max(n_users, 1))
+    for lv in ("day", "week"):
+        if span_days / AGG_LEVEL_DAYS[lv] <= cap:
+            return lv
+    return "month"
+
+def chart_points(dfx: pd.DataFrame, max_points: int, by: str = None) -> pd.DataFrame:
+    # 上限を系列数で割り、1 系列ずつ LTTB で間引く（短い期間はそのまま）
+    if dfx.empty: return dfx
+    n_traces = dfx[by].nunique() if by else 1
+    cap = max(CHART_MIN_POINTS_PER_TRACE, max_points // n_traces)
+    return frames.decimate(dfx, cap, by=by)
+
+def _to_json(fig, font_size: int) -> str:
+    fig.update_layout(margin=dict(l=8, r=8, t=48, b=8), font=dict(size=font_size))
+    return fig.to_json()
+
+def all_figure_json(dfw: pd.DataFrame, agg: frames.WeightAggregates, period_key: str, max_points: int,
+                    font_size: int = 13) -> str:
+    """全員のグラフ。生の行ではなく、期間に応じた日/週/月の平均から描く。データ無しは ""。"""
+    import plotly.express as px
+    if dfw.empty: return ""
+    level = agg_level(dfw, period_key, dfw["user_id"].nunique(), max_points)
+    dplot = chart_points(agg.frame(level, frames.period_start(period_key)), max_points, by="user_id")
+    if dplot.empty: return ""
+    fig = px.line(
+        dplot, x="date", y="weight", color="user_id", markers=True,
+        hover_data={"min": ":.1f", "max": ":.1f", "count": True},
+        title=f"全員の体重推移（{period_key}・{AGG_LEVEL_LABEL[level]}平均）",
+        labels={"date":"日付","weight":"体重(kg)","user_id":"ユーザー",
+                "min":"最小","max":"最大","count":"件数"}
+    )
+    return _to_json(fig, font_size)
+
+def user_figure_json(series: pd.DataFrame, trend: analytics.UserTrend, user_id: str, period_key: str,
+                     max_points: int, font_size: int = 13) -> str:
+    """1 人分のグラフ（移動平均とトレンドを重ねる）。データ無しは ""。"""
+    import plotly.express as px
+    dplot = chart_points(frames.filter_period(series, period_key), max_points)
+    if dplot.empty: return ""
+    fig = px.line(dplot, x="date", y="weight", markers=True,
+                  title=f"{user_id} の体重推移（{period_key}）",
+                  labels={"date":"日付","weight":"体重(kg)"})
+    tf = frames.filter_period(trend.frame.rename_axis("date").reset_index(), period_key)
+    for col, name, dash in TREND_LINES:
+        line = frames.decimate(tf[["date", col]].rename(columns={col: "weight"}).dropna(), max_points)
+        fig.add_scatter(x=line["date"], y=line["weight"], mode="lines", name=name,
+                        line=dict(dash=dash, width=1.5))
+    return _to_json(fig, font_size)
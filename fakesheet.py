@@ -0,0 +1,128 @@
+# ===== メモリ上のスプレッドシート（計測・障害再現用。ネットワーク・認証不要）=====
+# STORAGE_BACKEND = "fake" で使う。outage / latency を切り替えて、シートが落ちている・遅いときの
+# 動き（書き込みジャーナルの再送など）をローカルで確かめられる。
+import threading
+import time
+from collections import Counter
+
+import gspread
+
+from storage import USER_COLUMNS, WEIGHT_COLUMNS
+
+class MemoryWorksheet:
+    """gspread.Worksheet の代わり（読み書きはメモリ上の 2 次元リスト。値はシートと同じく文字列）。
+    SheetsBackend / WeightsSync が使うメソッドだけを持ち、呼び出し回数を calls に数える。
+    outage が真の間は ConnectionError、latency 秒だけ毎回待つ。書き込むたびに revision が進む。"""
+
+    def __init__(self, values: list, title: str = "", latency: float = 0.0):
+        self.title = title
+        self.values = [[str(v) for v in r] for r in values]
+        self.calls = Counter()
+        self.latency = latency
+        self.outage = False
+        self.revision = 0
+        self.lock = threading.Lock()
+
+    def _call(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.outage:
+            raise ConnectionError(f"{self.title}: simulated outage")
+
+    def get(self, range_name: str = None, pad_values: bool = False, **kw) -> list:
+        self._call("get")
+        with self.lock:
+            rows = self.values
+            if range_name is not None:
+                g = gspread.utils.a1_range_to_grid_range(range_name)
+                rows = [r[g.get("startColumnIndex", 0):g.get("endColumnIndex")]
+                        for r in rows[g.get("startRowIndex", 0):g.get("endRowIndex")]]
+            if not rows:
+                return [[]]
+            if pad_values:
+                width = max(len(r) for r in rows)
+                return [r + [""] * (width - len(r)) for r in rows]
+            return [list(r) for r in rows]
+
+    def col_values(self, col: int) -> list:
+        self._call("col_values")
+        with self.lock:
+            vals = [r[col - 1] if col <= len(r) else "" for r in self.values]
+        while vals and vals[-1] == "":
+            vals.pop()
+        return vals
+
+    def row_values(self, row: int) -> list:
+        self._call("row_values")
+        with self.lock:
+            return list(self.values[row - 1]) if row <= len(self.values) else []
+
+    def append_rows(self, rows: list, **kw):
+        self._call("append_rows")
+        with self.lock:
+            self.values.extend([str(v) for v in r] for r in rows)
+            self.revision += 1
+
+    def append_row(self, row: list, **kw):
+        self.append_rows([row])
+
+    def batch_update(self, data: list, **kw):
+        self._call("batch_update")
+        with self.lock:
+            for d in data:
+                r, c = gspread.utils.a1_to_rowcol(d["range"])
+                while len(self.values) < r:
+                    self.values.append([])
+                row = self.values[r - 1]
+                row += [""] * (c - len(row))
+                row[c - 1] = str(d["values"][0][0])
+            self.revision += 1
+
+class FakeSpreadsheet:
+    """users / weights の 2 枚。outage と latency は両方のシートにまとめて効く。"""
+
+    def __init__(self, users: list = None, weights: list = None, latency: float = 0.0):
+        self.users = MemoryWorksheet(users or [USER_COLUMNS], "users", latency)
+        self.weights = MemoryWorksheet(weights or [WEIGHT_COLUMNS], "weights", latency)
+
+    def get_lastUpdateTime(self) -> str:
+        """Spreadsheet.get_lastUpdateTime の代わり（どちらかのシートに書き込むと変わる）。"""
+        self.users._call("get_lastUpdateTime")
+        return f"{self.users.revision}.{self.weights.revision}"
+
+    @property
+    def outage(self) -> bool:
+        return self.users.outage
+
+    @outage.setter
+    def outage(self, value: bool):
+        self.users.outage = self.weights.outage = bool(value)
+
+    @property
+    def latency(self) -> float:
+        return self.users.latency
+
+    @latency.setter
+    def latency(self, sec: float):
+        self.users.latency = self.weights.latency = float(sec)
+
+# プロセス内で名前ごとに 1 つ（同じ名前なら全セッション・再接続で同じシートを見る）
+_sheets: dict = {}
+_sheets_lock = threading.Lock()
+
+def spreadsheet(name: str = "default", latency: float = 0.0) -> FakeSpreadsheet:
+    with _sheets_lock:
+        if name not in _sheets:
+            _sheets[name] = FakeSpreadsheet(latency=latency)
+        return _sheets[name]
+
+def open_fake(name: str = "default", latency: float = 0.0):
+    """open_sheets の代わり。outage 中は接続そのものが失敗する。"""
+    from metrics import InstrumentedWorksheet
+    from sheets import SheetsBackend
+    sh = spreadsheet(name, latency)
+    if sh.outage:
+        raise ConnectionError(f"{name}: simulated outage")
+    return SheetsBackend(InstrumentedWorksheet(sh.users), InstrumentedWorksheet(sh.weights),
+                         InstrumentedWorksheet(sh, name="spreadsheet"))
@@ -0,0 +1,289 @@
+# ===== weights フレームの集計・索引（pandas のみ、Streamlit 非依存）=====
+import threading
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+WEIGHT_FRAME_DTYPES = {"user_id": "category", "date": "datetime64[ns]", "weight": "float32"}
+
+def empty_weights() -> pd.DataFrame:
+    """列と型だけそろえた空の weights フレーム。"""
+    return pd.DataFrame({c: pd.Series(dtype=t) for c, t in WEIGHT_FRAME_DTYPES.items()})
+
+def to_numbers(values) -> np.ndarray:
+    """数値（またはその文字列）の列 → float 配列（不正は NaN）。
+    年・月・日・体重は値の種類が少ないので、種類ごとに 1 回だけ変換する。"""
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    conv = pd.to_numeric(pd.Series(uniques, dtype=object), errors="coerce").to_numpy(dtype=float)
+    return np.append(conv, np.nan)[codes]     # 欠損（-1）は末尾の NaN を指す
+
+def assemble_dates(year, month, day) -> pd.Series:
+    """年・月・日の列 → 日付。文字列を経由せず整数演算でまとめて組み立てる（不正な日付は NaT）。"""
+    idx = year.index if isinstance(year, pd.Series) else None
+    y, m, d = (to_numbers(v) for v in (year, month, day))
+    with np.errstate(invalid="ignore"):
+        ok = ((y % 1 == 0) & (m % 1 == 0) & (d % 1 == 0)
+              & (y >= 1678) & (y <= 2261) & (m >= 1) & (m <= 12) & (d >= 1) & (d <= 31))
+    months = np.where(ok, (y - 1970) * 12 + (m - 1), 0).astype(np.int64).astype("datetime64[M]")
+    days = months.astype("datetime64[D]") + np.where(ok, d - 1, 0).astype(np.int64)
+    ok &= days < (months + 1).astype("datetime64[D]")        # 月末を越える日（2/30 など）は不正
+    out = np.where(ok, days, np.datetime64("NaT")).astype("datetime64[ns]")
+    return pd.Series(out, index=idx, name="date")
+
+def weight_floats(s: pd.Series) -> pd.Series:
+    """float32 の体重を float64 に（2 進の端数が出ないよう 0.01kg で丸める）。書き出し用。"""
+    return s.astype(float).round(2)
+
+def _with_categories(s: pd.Series, cats: pd.Index) -> pd.Series:
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        extra = cats.difference(s.cat.categories)
+        if len(extra):
+            s = s.cat.add_categories(extra)     # 末尾に足すだけなら符号は付け直さない
+        return s if s.cat.categories.equals(cats) else s.cat.set_categories(cats)
+    return pd.Series(pd.Categorical(s.astype(str), categories=cats), index=s.index)
+
+def concat_weights(parts: list) -> pd.DataFrame:
+    """user_id のカテゴリをそろえて縦につなぐ（そろえないと object 列に戻ってしまう）。"""
+    parts = [p for p in parts if len(p)] or parts[:1]
+    if len(parts) == 1:
+        return parts[0]
+    base = parts[0]["user_id"]
+    cats = base.cat.categories if isinstance(base.dtype, pd.CategoricalDtype) \
+        else pd.Index(base.astype(str).unique())
+    for p in parts[1:]:
+        cats = cats.append(pd.Index(p["user_id"].astype(str).unique()).difference(cats))
+    return pd.concat([p.assign(user_id=_with_categories(p["user_id"], cats)) for p in parts])
+
+def frame_version(df: pd.DataFrame) -> int:
+    """内容が同じなら同じ値になるバージョン印（キャッシュキー用）。"""
+    if df.empty:
+        return 0
+    return int(pd.util.hash_pandas_object(df, index=False).sum())
+
+# --------------------------------
+# 表示期間
+# --------------------------------
+def period_start(key: str):
+    """表示期間（"1か月" / "3か月" / "全期間"）の開始日。全期間は None。"""
+    today = pd.Timestamp.today().normalize()
+    if key == "1か月":
+        return today - relativedelta(months=1)
+    if key == "3か月":
+        return today - relativedelta(months=3)
+    return None
+
+def filter_period(dfx: pd.DataFrame, key: str) -> pd.DataFrame:
+    if dfx.empty: return dfx
+    since = period_start(key)
+    if since is None:
+        since = dfx["date"].min()
+    return dfx[dfx["date"] >= since].sort_values("date")
+
+# --------------------------------
+# ユーザー別インデックス
+# --------------------------------
+class WeightIndex:
+    """weights を user_id ごとに日付順で分割しておく。
+    ユーザーの系列・最新記録は dict / ハッシュ索引で O(1) に引ける。"""
+
+    def __init__(self, dfw: pd.DataFrame, version: int = None):
+        self.version = frame_version(dfw) if version is None else version
+        dfw = dfw.sort_values("date", kind="stable")
+        self.empty = dfw.iloc[0:0]
+        self.series = {uid: g for uid, g in dfw.groupby("user_id", sort=False)}
+        # 各ユーザーの最終行（user_id を索引にした 1 ユーザー 1 行の表）
+        self.latest = dfw.drop_duplicates("user_id", keep="last").set_index("user_id", drop=False)
+
+    def user(self, user_id: str) -> pd.DataFrame:
+        return self.series.get(user_id, self.empty)
+
+    def last(self, user_id: str):
+        """最新の 1 行（Series）。記録が無ければ None。"""
+        if user_id not in self.latest.index:
+            return None
+        return self.latest.loc[user_id]
+
+def append_weights(dfw: pd.DataFrame, add: pd.DataFrame) -> pd.DataFrame:
+    """正規化済みの行を足して日付順を保つ（キャッシュへの差し込み用）。"""
+    if add.empty:
+        return dfw
+    start = dfw.index.max() + 1 if len(dfw) else 0
+    add = add.set_axis(pd.RangeIndex(start, start + len(add)))
+    return concat_weights([dfw, add]).sort_values("date", kind="stable")
+
+# --------------------------------
+# ユーザー一覧の検索・ページ送り（管理者画面用）
+# --------------------------------
+class UserIndex:
+    """並べ替え済みの user_id。前方一致は二分探索、部分一致はベクトル演算で絞る。"""
+
+    def __init__(self, user_ids):
+        self.ids = np.array(sorted(set(user_ids)), dtype=object)
+        self.lower = pd.Series(self.ids, dtype=object).str.lower()
+
+    def prefix(self, p: str) -> np.ndarray:
+        lo = np.searchsorted(self.ids, p, side="left")
+        hi = np.searchsorted(self.ids, p + "\U0010ffff", side="left")
+        return self.ids[lo:hi]
+
+    def search(self, q: str, mode: str = "prefix") -> np.ndarray:
+        """mode: "prefix"（大文字小文字を区別）/ "contains"（区別しない）。空なら全員。"""
+        if not q:
+            return self.ids
+        if mode == "prefix":
+            return self.prefix(q)
+        return self.ids[self.lower.str.contains(q.lower(), regex=False).to_numpy()]
+
+def page_bounds(n: int, page: int, page_size: int):
+    """(start, end, ページ数)。page は 1 始まりで、範囲外は端に寄せる。"""
+    n_pages = max(1, -(-n // page_size))
+    page = min(max(int(page), 1), n_pages)
+    start = (page - 1) * page_size
+    return start, min(start + page_size, n), n_pages
+
+LATEST_NUMERIC_COLUMNS = ("体重(kg)", "身長(cm)", "BMI")
+
+def sort_positions(t: pd.DataFrame, column: str, ascending: bool = True) -> np.ndarray:
+    """t を column で並べたときの行位置（数値列は数値として、空欄・未設定は常に末尾）。"""
+    key = t[column]
+    if column in LATEST_NUMERIC_COLUMNS:
+        key = pd.to_numeric(key, errors="coerce")
+    elif column in ("最新日", "到達予測日"):
+        key = pd.to_datetime(key, errors="coerce")
+    key = key.reset_index(drop=True)
+    return key.sort_values(ascending=ascending, na_position="last", kind="stable").index.to_numpy()
+
+# --------------------------------
+# ユーザー × 日/週/月 の集計（全員のグラフ用。追加分だけ足し込む）
+# --------------------------------
+AGG_LEVELS = ("day", "week", "month")
+
+def bucket_start(dates: pd.Series, level: str) -> pd.Series:
+    """各日付が属する日/週（月曜始まり）/月の初日。"""
+    d = pd.to_datetime(dates).dt.normalize()
+    if level == "week":
+        return d - pd.to_timedelta(d.dt.weekday, unit="D")
+    if level == "month":
+        return pd.Series(d.to_numpy(dtype="datetime64[M]").astype("datetime64[ns]"), index=d.index)
+    return d
+
+def _aggregate(dfw: pd.DataFrame, level: str) -> pd.DataFrame:
+    if dfw.empty:
+        idx = pd.MultiIndex.from_arrays([[], pd.DatetimeIndex([])], names=["user_id", "date"])
+        return pd.DataFrame({"sum": [], "min": [], "max": [], "count": []}, index=idx)
+    keys = [dfw["user_id"].astype(str).rename("user_id"), bucket_start(dfw["date"], level).rename("date")]
+    return dfw["weight"].astype(float).groupby(keys).agg(["sum", "min", "max", "count"])
+
+class WeightAggregates:
+    """user × 日/週/月ごとの体重（平均・最小・最大・件数）。
+    平均は sum / count で持つので、追加行は該当するバケットだけ更新すればよい。
+    表は差し替えで更新する（読み手は取得時点の表をそのまま使える）。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.tables = {lv: _aggregate(pd.DataFrame(), lv) for lv in AGG_LEVELS}
+
+    def sync(self, dfw: pd.DataFrame, version: int):
+        """weights の版が変わっていたら（外部からの変更・再読込）作り直す。"""
+        if self.version == version:
+            return
+        with self.lock:
+            if self.version != version:
+                self.tables = {lv: _aggregate(dfw, lv) for lv in AGG_LEVELS}
+                self.version = version
+
+    def add(self, rows: pd.DataFrame, prev_version: int, version: int):
+        """prev_version の表に rows を足した結果を version として記録する。
+        手元が prev_version でなければ何もしない（次の sync で作り直す）。"""
+        with self.lock:
+            if self.version != prev_version or rows.empty:
+                return
+            for lv, t in self.tables.items():
+                new = _aggregate(rows, lv)
+                both = new.index.intersection(t.index)
+                if len(both):
+                    t, cur, n = t.copy(), t.loc[both], new.loc[both]
+                    t.loc[both, "sum"] = cur["sum"] + n["sum"]
+                    t.loc[both, "count"] = cur["count"] + n["count"]
+                    t.loc[both, "min"] = np.minimum(cur["min"], n["min"])
+                    t.loc[both, "max"] = np.maximum(cur["max"], n["max"])
+                self.tables[lv] = pd.concat([t, new.drop(both)]) if len(new) > len(both) else t
+            self.version = version
+
+    def frame(self, level: str, since=None) -> pd.DataFrame:
+        """user_id, date, weight（平均）, min, max, count の表（ユーザー・日付順）。"""
+        t = self.tables[level]
+        if since is not None:
+            t = t[t.index.get_level_values("date") >= pd.Timestamp(since)]
+        out = t.sort_index().reset_index()
+        return out.assign(weight=out["sum"] / out["count"]).drop(columns="sum")
+
+# --------------------------------
+# 全員の最新情報（ユーザー × 最新記録を一括で）
+# --------------------------------
+def bmi_values(weight, height_cm) -> np.ndarray:
+    """BMI をまとめて計算。身長が未設定/0 以下の行は NaN。"""
+    w = pd.to_numeric(pd.Series(weight), errors="coerce").to_numpy(dtype=float)
+    h = pd.to_numeric(pd.Series(height_cm), errors="coerce").to_numpy(dtype=float) / 100
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bmi = w / (h ** 2)
+    bmi[~(h > 0)] = np.nan
+    return bmi
+
+def latest_table(dfu: pd.DataFrame, latest: pd.DataFrame) -> pd.DataFrame:
+    """users と各ユーザーの最新記録（WeightIndex.latest）を 1 回の merge で結合した表。"""
+    t = dfu[["user_id", "plain_password", "height_cm"]].merge(
+        latest[["user_id", "date", "weight"]].reset_index(drop=True),
+        on="user_id", how="left",
+    )
+    has_w = t["weight"].notna()
+    has_h = t["height_cm"].notna()
+    bmi = pd.Series(bmi_values(t["weight"], t["height_cm"]), index=t.index)
+    bmi_txt = bmi.map(lambda v: "未設定" if np.isnan(v) else f"{v:.1f}")
+    pw = t["plain_password"]
+    return pd.DataFrame({
+        "user": t["user_id"],
+        "password": pw.where(pw.fillna("").astype(bool), "-"),   # 平文パスワード表示
+        "最新日": pd.to_datetime(t["date"]).dt.date.astype(object).where(has_w, None),
+        "体重(kg)": t["weight"].map("{:.1f}".format).where(has_w, "-"),
+        "身長(cm)": t["height_cm"].map("{:.1f}".format).where(has_h, "-"),
+        "BMI": bmi_txt.where(has_w & has_h, "未"),
+    })
+
+# --------------------------------
+# グラフ用の間引き（LTTB: Largest-Triangle-Three-Buckets）
+# --------------------------------
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """形を保ったまま n_out 点を選ぶ。先頭・末尾は必ず残す。"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)   # 中間 n_out-2 バケットの境界
+    out = np.empty(n_out, dtype=int)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo = edges[i + 1]
+        nhi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+def decimate(dfx: pd.DataFrame, max_points: int, by: str = None) -> pd.DataFrame:
+    """日付順の系列を 1 系列あたり max_points 点まで間引く（by 指定で系列ごと）。"""
+    if dfx.empty:
+        return dfx
+    if by is not None:
+        if dfx.groupby(by, sort=False).size().max() <= max_points:
+            return dfx
+        return pd.concat([decimate(g, max_points) for _, g in dfx.groupby(by, sort=False)])
+    if len(dfx) <= max_points:
+        return dfx
+    x = dfx["date"].to_numpy(dtype="datetime64[s]").astype(float) / 86400.0
+    y = dfx["weight"].to_numpy(dtype=float)
+    return dfx.iloc[lttb_indices(x, y, max_points)]
@@ -0,0 +1,306 @@
+# ===== 書き込みジャーナル（シートに届くまでローカルに保存し、つながったら送り直す）=====
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+import frames
+from storage import (USER_COLUMNS, WEIGHT_COLUMNS, StaleRead, StorageBackend, normalize_uid,
+                     normalize_users, normalize_weights)
+
+log = logging.getLogger(__name__)
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    args TEXT NOT NULL,
+    created REAL NOT NULL,
+    tries INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT '',
+    lease REAL NOT NULL DEFAULT 0
+);
+"""
+REPLAY_RETRY_SEC = 5           # 送れなかったら、この秒数から倍々で待って再送
+REPLAY_RETRY_MAX_SEC = 300
+REPLAY_LEASE_SEC = 120         # 再送中の分を他のプロセスが送らないよう、この秒数だけ押さえる
+
+class Journal:
+    """まだシートに届いていない書き込み（op と引数）を SQLite に古い順で持つ。"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.executescript(JOURNAL_SCHEMA)
+
+    def add(self, op: str, args: list) -> int:
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "INSERT INTO pending (op, args, created) VALUES (?,?,?)",
+                (op, json.dumps(args, ensure_ascii=False, default=str), time.time()),
+            ).lastrowid
+
+    def entries(self) -> list:
+        """[(id, op, args, tries), ...]（古い順）"""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, op, args, tries FROM pending ORDER BY id").fetchall()
+        return [(i, op, json.loads(a), t) for i, op, a, t in rows]
+
+    def claim(self, sec: float = REPLAY_LEASE_SEC) -> list:
+        """未送信分をまとめて押さえて返す。他のプロセスが再送中なら空（順序を崩さないよう全部待つ）。"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if self.conn.execute("SELECT 1 FROM pending WHERE lease > ? LIMIT 1", (now,)).fetchone():
+                return []
+            self.conn.execute("UPDATE pending SET lease = ?", (now + sec,))
+            rows = self.conn.execute("SELECT id, op, args, tries FROM pending ORDER BY id").fetchall()
+        return [(i, op, json.loads(a), t) for i, op, a, t in rows]
+
+    def remove(self, entry_id: int):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM pending WHERE id = ?", (entry_id,))
+
+    def attempt(self, entry_id: int):
+        """送る直前に数える（送った後に落ちても、次は届いているかを確かめてから送る）。"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE pending SET tries = tries + 1 WHERE id = ?", (entry_id,))
+
+    def failed(self, entry_id: int, error: Exception):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE pending SET last_error = ?, lease = 0 WHERE id = ?",
+                              (repr(error)[:500], entry_id))
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+def retryable(e: Exception) -> bool:
+    """列・ユーザーが無い、4xx（429 以外）などは送り直しても通らない。"""
+    if isinstance(e, (LookupError, ValueError, TypeError)):
+        return False
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return not (status is not None and 400 <= status < 500 and status != 429)
+
+class JournaledBackend(StorageBackend):
+    """シート（remote）の前に置く書き込みジャーナル。
+    書き込みはまずジャーナルに保存し、バックグラウンドのスレッドが古い順にシートへ送る。
+    シートに届いたら Future が完了し、ジャーナルから消える（落ちている間は残り続ける）。
+    読み込みは最後に読めたシートの内容＋未送信分。接続は必要になった時点で張る（起動時に落ちていても動く）。"""
+
+    def __init__(self, connect, path: str):
+        self.connect = connect
+        self.remote = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.journal = Journal(path)
+        self.futures: dict = {}          # 未送信エントリーの id → Future（このプロセスで書いた分）
+        self.snap_users = normalize_users(pd.DataFrame())
+        self.snap_weights = frames.empty_weights()
+        self.wake = threading.Event()
+        threading.Thread(target=self._run, daemon=True, name="journal").start()
+
+    # ---- 接続 ----
+    def _remote(self):
+        with self.lock:
+            if self.remote is None:
+                try:
+                    self.remote = self.connect()
+                    self.error = None
+                except Exception as e:
+                    self.error = e
+                    log.warning("sheets unavailable: %s", e)
+            return self.remote
+
+    def ready(self) -> bool:
+        return self._remote() is not None
+
+    def revision(self, table: str):
+        # つながっていなければ None（読み直しのたびに接続を試す）
+        r = self._remote()
+        return None if r is None else r.revision(table)
+
+    def sync_status(self) -> dict:
+        return {"pending": self.journal.count(), "error": self.error}
+
+    # ---- 読み込み（シート＋未送信分。シートから読めなければ、最後に読めた内容で StaleRead）----
+    def _read(self, method: str, snap_attr: str):
+        """(シートの内容, 読めたか)"""
+        r = self._remote()
+        if r is None:
+            return getattr(self, snap_attr), False
+        try:
+            setattr(self, snap_attr, getattr(r, method)())
+            self.error = None
+            return getattr(self, snap_attr), True
+        except Exception as e:
+            self.error = e
+            log.warning("sheets read failed (%s); using last snapshot", e)
+            return getattr(self, snap_attr), False
+
+    def _result(self, frame: pd.DataFrame, ok: bool) -> pd.DataFrame:
+        if not ok:
+            raise StaleRead(frame, self.error)
+        return frame
+
+    def users_frame(self) -> pd.DataFrame:
+        u, ok = self._read("users_frame", "snap_users")
+        return self._result(self._overlay_users(u), ok)
+
+    def _overlay_users(self, u: pd.DataFrame) -> pd.DataFrame:
+        entries = self.journal.entries()
+        adds = [a[0] for _, op, a, _ in entries if op == "append_user"]
+        updates = [a for _, op, a, _ in entries if op == "update_user_field"]
+        if not adds and not updates:
+            return u
+        u = u.copy()
+        if adds:
+            new = pd.DataFrame(adds).reindex(columns=USER_COLUMNS)
+            new = new[~new["user_id"].isin(u["user_id"])]
+            u = pd.concat([u, new], ignore_index=True) if len(u) else new.reset_index(drop=True)
+        for user_id, field, value in updates:
+            if field in u.columns:
+                u[field] = u[field].astype(object).mask(u["user_id"] == user_id, value)
+        return normalize_users(u)
+
+    def weights_frame(self) -> pd.DataFrame:
+        w, ok = self._read("weights_frame", "snap_weights")
+        return self._result(self._overlay_weights(w), ok)
+
+    def _overlay_weights(self, w: pd.DataFrame) -> pd.DataFrame:
+        entries = [(a[0], tries) for _, op, a, tries in self.journal.entries() if op == "append_weights"]
+        if not entries:
+            return w
+        add = normalize_weights(pd.DataFrame([r for rows, _ in entries for r in rows], columns=WEIGHT_COLUMNS))
+        # 送信済み（で、まだジャーナルから消えていない）分はシートの内容と重ならないように除く
+        tried = np.repeat([t > 0 for _, t in entries], [len(rows) for rows, _ in entries])[add.index]
+        if tried.any() and len(w):
+            have = set(zip(*_keys(w)))
+            add = add[~(tried & np.array([k in have for k in zip(*_keys(add))], dtype=bool))]
+        return frames.append_weights(w, add)
+
+    # ---- 書き込み（ジャーナルへ → 送信待ち）----
+    def _enqueue(self, op: str, args: list) -> Future:
+        fut = Future()
+        entry_id = self.journal.add(op, args)
+        with self.lock:
+            self.futures[entry_id] = fut
+        self.wake.set()
+        return fut
+
+    def append_user(self, record: dict) -> Future:
+        return self._enqueue("append_user", [record])
+
+    def update_user_field(self, user_id: str, field: str, value) -> Future:
+        if field not in USER_COLUMNS or field == "user_id":
+            raise KeyError(field)
+        return self._enqueue("update_user_field", [user_id, field, value])
+
+    def append_weights(self, rows: list) -> Future:
+        return self._enqueue("append_weights", [rows])
+
+    def release(self):
+        # シートにつながらない間は手放さない（読み直せず、最後に読めた内容が消えてしまう）
+        if self.remote is None:
+            return
+        try:
+            self.remote.revision("users")   # 安い呼び出しで、いま読めるかを確かめる
+        except Exception as e:
+            self.error = e
+            return
+        self.snap_users = normalize_users(pd.DataFrame())
+        self.snap_weights = frames.empty_weights()
+        if self.remote is not None:
+            self.remote.release()
+
+    # ---- 再送 ----
+    def _finish(self, entry_id: int, error: Exception = None):
+        self.journal.remove(entry_id)
+        with self.lock:
+            fut = self.futures.pop(entry_id, None)
+        if fut is not None and not fut.done():
+            fut.set_exception(error) if error is not None else fut.set_result(True)
+
+    def _settle_gone(self):
+        # 同じジャーナルを使う別のプロセスが送り終えた分
+        ids = {i for i, *_ in self.journal.entries()}
+        with self.lock:
+            gone = [i for i in self.futures if i not in ids]
+        for entry_id in gone:
+            self._finish(entry_id)
+
+    def _already_applied(self, r, op: str, args: list, seen: dict) -> bool:
+        # 前回の送信が届いたのに応答だけ失われた場合に二重に書かないよう、シート側を確かめる
+        # （シートの読み込みは 1 回の再送につき表ごとに 1 回: seen）
+        if op == "append_user":
+            if "users" not in seen:
+                seen["users"] = set(r.users_frame()["user_id"])
+            return normalize_uid(args[0]["user_id"]) in seen["users"]
+        if op == "append_weights":
+            if "weights" not in seen:
+                seen["weights"] = set(zip(*_keys(r.weights_frame())))
+            add = normalize_weights(pd.DataFrame(args[0], columns=WEIGHT_COLUMNS))
+            return all(k in seen["weights"] for k in zip(*_keys(add)))
+        return False     # セルの更新は何度送っても同じ
+
+    def replay(self) -> bool:
+        """未送信分を古い順にまとめて送る。全部届いた（または無い）なら True。"""
+        self._settle_gone()
+        if not self.journal.count():
+            return True
+        r = self._remote()
+        if r is None:
+            return False
+        entries = self.journal.claim()
+        if not entries:
+            return False
+        sent, seen = [], {}
+        for entry_id, op, args, tries in entries:
+            try:
+                if tries and self._already_applied(r, op, args, seen):
+                    self._finish(entry_id)
+                    continue
+                self.journal.attempt(entry_id)
+                fut = getattr(r, op)(*args)
+            except Exception as e:
+                fut = Future()
+                fut.set_exception(e)
+            sent.append((entry_id, fut))
+        ok = True
+        for entry_id, fut in sent:
+            e = fut.exception()
+            if e is None:
+                self._finish(entry_id)
+            elif ok and not retryable(e):
+                log.error("dropping journal entry %s: %s", entry_id, e)
+                self._finish(entry_id, e)
+            else:
+                # 前のエントリーが届いていないなら、後ろの失敗も（順序待ちかもしれないので）残す
+                ok = False
+                self.journal.failed(entry_id, e)
+                self.error = e
+        if ok:
+            self.error = None
+        return ok
+
+    def _run(self):
+        delay = REPLAY_RETRY_SEC
+        while True:
+            self.wake.wait(timeout=delay)
+            self.wake.clear()
+            try:
+                ok = self.replay()
+            except Exception:
+                log.exception("journal replay failed")
+                ok = False
+            delay = REPLAY_RETRY_SEC if ok else min(delay * 2, REPLAY_RETRY_MAX_SEC)
+
+def _keys(dfw: pd.DataFrame):
+    return (dfw["user_id"].astype(str).tolist(), dfw["date"].tolist(),
+            frames.weight_floats(dfw["weight"]).tolist())
@@ -0,0 +1,195 @@
+# ===== 計測（実行ごとの段階時間・Sheets 呼び出し・キャッシュ命中率）=====
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+RECENT_RUNS = 50    # 直近の実行記録をこの件数だけ残す
+PREFIX = "weight_tracker"
+
+class Stat:
+    __slots__ = ("count", "errors", "total", "max")
+
+    def __init__(self):
+        self.count = self.errors = 0
+        self.total = self.max = 0.0
+
+    def add(self, sec: float, ok: bool = True):
+        self.count += 1
+        self.errors += 0 if ok else 1
+        self.total += sec
+        self.max = max(self.max, sec)
+
+class Registry:
+    """プロセス共有の集計。段階時間は実行（Streamlit の 1 回の再実行）ごとにも記録する。
+    実行中の段階はスレッドごとに持つ（セッションの実行はそれぞれ別スレッド）。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages: dict = {}      # 段階名 → Stat
+        self.calls: dict = {}       # "users.get" など → Stat
+        self.caches: dict = {}      # 名前 → DatasetCache（hits / misses を読む）
+        self.runs = deque(maxlen=RECENT_RUNS)
+        self.local = threading.local()
+
+    def _add(self, table: dict, name: str, sec: float, ok: bool = True):
+        with self.lock:
+            table.setdefault(name, Stat()).add(sec, ok)
+
+    # ---- 実行ごとの段階 ----
+    def begin_run(self):
+        self.local.run = {}
+        self.local.lap_at = time.perf_counter()
+
+    def _run_add(self, name: str, sec: float):
+        run = getattr(self.local, "run", None)
+        if run is not None:
+            run[name] = run.get(name, 0.0) + sec
+
+    def lap(self, name: str):
+        """前回の lap（または begin_run）からここまでを name として記録する。"""
+        now = time.perf_counter()
+        sec = now - getattr(self.local, "lap_at", now)
+        self.local.lap_at = now
+        self._add(self.stages, name, sec)
+        self._run_add(name, sec)
+
+    @contextmanager
+    def stage(self, name: str):
+        """with の中を name として記録する（lap の区間と重なってよい）。"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            sec = time.perf_counter() - t0
+            self._add(self.stages, name, sec)
+            self._run_add(name, sec)
+
+    def timed(self, name: str, fn=None):
+        """fn を name の段階として計る関数にして返す（fn 省略でデコレーター）。"""
+        if fn is None:
+            return lambda f: self.timed(name, f)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def end_run(self, total_sec: float, **extra) -> dict:
+        run = getattr(self.local, "run", None) or {}
+        self.local.run = None
+        rec = {"event": "rerun", "ts": round(time.time(), 3), "total_ms": round(total_sec * 1000, 1),
+               "stages_ms": {k: round(v * 1000, 1) for k, v in run.items()}, **extra}
+        self.runs.append(rec)
+        log.info(json.dumps(rec, ensure_ascii=False))
+        return rec
+
+    # ---- Sheets 呼び出し・キャッシュ ----
+    def record_call(self, name: str, sec: float, ok: bool = True):
+        self._add(self.calls, name, sec, ok)
+
+    def watch_cache(self, name: str, cache):
+        self.caches[name] = cache
+
+    # ---- 出力 ----
+    def stage_rows(self) -> list:
+        with self.lock:
+            return [{"stage": k, "count": s.count, "avg_ms": s.total / s.count * 1000,
+                     "max_ms": s.max * 1000, "total_s": s.total} for k, s in self.stages.items()]
+
+    def call_rows(self) -> list:
+        with self.lock:
+            return [{"method": k, "count": s.count, "errors": s.errors, "avg_ms": s.total / s.count * 1000,
+                     "max_ms": s.max * 1000, "total_s": s.total} for k, s in self.calls.items()]
+
+    def cache_rows(self) -> list:
+        rows = []
+        for name, c in self.caches.items():
+            n = c.hits + c.misses
+            rows.append({"cache": name, "hits": c.hits, "misses": c.misses,
+                         "hit_rate": c.hits / n if n else None})
+        return rows
+
+    def prometheus_text(self) -> str:
+        """Prometheus のテキスト形式（/metrics 用）。"""
+        out = []
+        def metric(name, kind, samples):
+            out.append(f"# TYPE {PREFIX}_{name} {kind}")
+            out.extend(f"{PREFIX}_{name}{labels} {value:g}" for labels, value in samples)
+        st, calls = self.stage_rows(), self.call_rows()
+        metric("stage_seconds", "summary",
+               [(f'_count{{stage="{r["stage"]}"}}', r["count"]) for r in st]
+               + [(f'_sum{{stage="{r["stage"]}"}}', r["total_s"]) for r in st])
+        metric("sheets_calls_total", "counter", [(f'{{method="{r["method"]}"}}', r["count"]) for r in calls])
+        metric("sheets_call_errors_total", "counter", [(f'{{method="{r["method"]}"}}', r["errors"]) for r in calls])
+        metric("sheets_call_seconds_total", "counter", [(f'{{method="{r["method"]}"}}', r["total_s"]) for r in calls])
+        metric("cache_requests_total", "counter",
+               [(f'{{cache="{r["cache"]}",result="{res}"}}', r[col])
+                for r in self.cache_rows() for res, col in (("hit", "hits"), ("miss", "misses"))])
+        return "\n".join(out) + "\n"
+
+REGISTRY = Registry()
+
+begin_run = REGISTRY.begin_run
+lap = REGISTRY.lap
+stage = REGISTRY.stage
+timed = REGISTRY.timed
+end_run = REGISTRY.end_run
+
+# --------------------------------
+# gspread のワークシートを包んで呼び出しを数える
+# --------------------------------
+class InstrumentedWorksheet:
+    """メソッド呼び出しを "<シート名>.<メソッド>" ごとに回数・時間・失敗数で記録する（name で名前を指定可）。"""
+
+    def __init__(self, ws, registry: Registry = REGISTRY, name: str = None):
+        self._ws = ws
+        self._registry = registry
+        self._name = name or getattr(ws, "title", "sheet")
+
+    def __getattr__(self, attr):
+        value = getattr(self._ws, attr)
+        if not callable(value):
+            return value
+        name = f"{self._name}.{attr}"
+
+        def call(*args, **kwargs):
+            t0, ok = time.perf_counter(), False
+            try:
+                result = value(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                self._registry.record_call(name, time.perf_counter() - t0, ok)
+        return call
+
+# --------------------------------
+# /metrics エンドポイント（METRICS_PORT を設定したときだけ）
+# --------------------------------
+def serve(port: int, registry: Registry = REGISTRY):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
@@ -0,0 +1,315 @@
+# ===== Google Sheets バックエンド（gspread）=====
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import gspread
+import numpy as np
+import pandas as pd
+
+import frames
+from metrics import InstrumentedWorksheet
+from storage import StorageBackend, normalize_uid, normalize_users, normalize_weights
+
+log = logging.getLogger(__name__)
+
+# --------------------------------
+# weights 差分同期（前回の行数を覚えて追記分だけ読む）
+# --------------------------------
+WEIGHTS_FULL_RESYNC_SEC = 600   # 追記と同時に途中行が直された場合も拾うため、この間隔で全件読み直す
+
+def _trim_row(row) -> list:
+    row = [str(v) for v in row]
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+class WeightsSync:
+    """weights シートのキャッシュ。末尾行をアンカーに追記分だけ range で取得する。
+    アンカー行が消えた/変わった（切り詰め・既存行の編集）とき、追記では説明のつかない変更があったとき、
+    WEIGHTS_FULL_RESYNC_SEC を過ぎたときは全件読み直す。"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.lock = threading.Lock()
+        self.header: list = []
+        self.n_rows = 0                 # 取り込んだ行数（ヘッダーを除く）
+        self.last_row: list = []        # 最後に取り込んだ生の行（次の差分読み込みのアンカー）
+        self.frame = normalize_weights(pd.DataFrame())
+        self.full_at = 0.0
+        self.generation = 0             # 全件読み込みの回数
+        self.stale = False              # 次の refresh は全件読み込み
+
+    def _to_frame(self, rows, start: int) -> pd.DataFrame:
+        # 数値の変換は normalize_weights がまとめて行う。user_id だけは users 側と同じく
+        # numericise してから文字列に戻す（"007" → "7"）。どちらも値の種類ごとに 1 回だけ
+        df = pd.DataFrame(rows).reindex(columns=range(len(self.header)))
+        df.columns = self.header
+        df.index = pd.RangeIndex(start, start + len(df))
+        if "user_id" in df.columns and len(df):
+            codes, uniques = pd.factorize(df["user_id"], use_na_sentinel=False)
+            df["user_id"] = np.array([gspread.utils.numericise(v) for v in uniques], dtype=object)[codes]
+        return normalize_weights(df)
+
+    def _full_reload(self):
+        values = [_trim_row(r) for r in self.ws.get(pad_values=True)]
+        self.header = values[0] if values else []
+        rows = values[1:]
+        self.n_rows = len(rows)
+        self.last_row = rows[-1] if rows else []
+        self.frame = self._to_frame(rows, 0) if self.header else normalize_weights(pd.DataFrame())
+        self.full_at = time.time()
+        self.generation += 1
+        self.stale = False
+
+    def _tail(self) -> list:
+        # 最後に取り込んだ行（0件ならヘッダー行）から後ろだけ読む
+        last_col = re.sub(r"\d", "", gspread.utils.rowcol_to_a1(1, len(self.header)))
+        return [_trim_row(r) for r in self.ws.get(f"A{self.n_rows + 1}:{last_col}")]
+
+    def resync_due(self) -> bool:
+        return bool(self.header) and time.time() - self.full_at > WEIGHTS_FULL_RESYNC_SEC
+
+    def revision(self, changed: bool = False):
+        """末尾だけ読んで (全件読み込みの回数, 行数, 最後の行)。
+        changed はシートが更新されたと分かっている（ほかに理由が無い）こと。末尾に増えていなければ
+        途中の行が直されたとみなし、次の refresh を全件読み込みにする（版は読み直すまで同じ値）。
+        まだ読み込んでいなければ、最初の全件読み込みの後の値。"""
+        with self.lock:
+            if self.header and not self.stale and not self.resync_due():
+                got = self._tail()
+                if got and got[0] == (self.last_row if self.n_rows else self.header) \
+                        and not (changed and len(got) == 1):
+                    return (self.generation, self.n_rows + len(got) - 1, tuple(got[-1]))
+            self.stale = True
+            return (self.generation + 1,)
+
+    def refresh(self) -> pd.DataFrame:
+        with self.lock:
+            if not self.header or self.stale or self.resync_due():
+                self._full_reload()
+                return self.frame
+            got = self._tail()
+            known = self.last_row if self.n_rows else self.header
+            if not got or got[0] != known:
+                self._full_reload()
+                return self.frame
+            new_rows = got[1:]
+            if new_rows:
+                add = self._to_frame(new_rows, self.n_rows)
+                self.n_rows += len(new_rows)
+                self.last_row = new_rows[-1]
+                if not add.empty:
+                    self.frame = frames.concat_weights([self.frame, add]).sort_values("date", kind="stable")
+            return self.frame
+
+# --------------------------------
+# Sheets 書き込みキュー（まとめ書き・指数バックオフ）
+# --------------------------------
+WRITE_COALESCE_SEC = 0.3     # 最初の 1 件から、この間に来た書き込みを 1 回にまとめる
+WRITE_MAX_TRIES = 6
+WRITE_MAX_ROWS = 5000        # append_rows 1 回あたりの上限
+WRITE_BACKOFF_MAX_SEC = 32
+
+def _retryable(e: Exception) -> bool:
+    resp = getattr(e, "response", None)
+    status = getattr(resp, "status_code", None)
+    if isinstance(e, gspread.exceptions.APIError):
+        return status == 429 or (status is not None and status >= 500)
+    return isinstance(e, (ConnectionError, TimeoutError)) or type(e).__module__.startswith("requests")
+
+def with_backoff(fn, tries: int = WRITE_MAX_TRIES):
+    """429 / 5xx / 通信エラーは 1, 2, 4 … 秒（＋ゆらぎ）待って再試行。"""
+    delay = 1.0
+    for attempt in range(tries):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == tries - 1 or not _retryable(e):
+                raise
+            log.warning("sheets call failed (%s); retry in %.1fs", e, delay)
+            time.sleep(delay + random.uniform(0, delay / 2))
+            delay = min(delay * 2, WRITE_BACKOFF_MAX_SEC)
+
+def _settle(futures, fn):
+    try:
+        with_backoff(fn)
+    except Exception as e:
+        for f in futures:
+            f.set_exception(e)
+    else:
+        for f in futures:
+            f.set_result(True)
+
+class SheetsWriter:
+    """書き込みを 1 本のスレッドで順に流す。submit() は書き込み完了で終わる Future を返す。
+    溜まった分は flush(batch) にまとめて渡す（batch は [(op, future), ...]）。"""
+
+    def __init__(self, flush):
+        self.flush = flush
+        self.q: queue.Queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, op) -> Future:
+        fut = Future()
+        self.q.put((op, fut))
+        return fut
+
+    def _run(self):
+        while True:
+            batch = [self.q.get()]
+            time.sleep(WRITE_COALESCE_SEC)
+            while True:
+                try:
+                    batch.append(self.q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.flush(batch)
+            except Exception as e:       # flush 内で拾えなかった分は失敗として返す
+                log.exception("sheets flush failed")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+# --------------------------------
+# Google Sheets バックエンド
+# --------------------------------
+class SheetsBackend(StorageBackend):
+    """読み込みは同期、書き込みは SheetsWriter 経由（Future を返す）。
+    users のヘッダー行は読み込みのたびに覚えておき、書き込み前に取り直さない。
+    revision() はスプレッドシートの最終更新時刻（Drive のメタデータ 1 回）で変更の有無を確かめ、
+    変わっていたときだけシートごとに確かめる（weights の追記で users を読み直さない）。"""
+
+    def __init__(self, users_ws, weights_ws, spreadsheet=None):
+        self.users_ws = users_ws
+        self.weights_ws = weights_ws
+        self.spreadsheet = spreadsheet
+        self.weights = WeightsSync(weights_ws)
+        self.users_header: list = []
+        self.seen: dict = {}             # 表 → (最後に確かめたときの更新時刻, そのときの版)
+        self.users_written = False       # users に書き込んだ（更新時刻が変わった理由が分かっている）
+        self.writer = SheetsWriter(self._flush)
+
+    def _read_users(self) -> list:
+        values = self.users_ws.get(pad_values=True)
+        if values == [[]]:
+            values = []
+        self.users_header = _trim_row(values[0]) if values else []
+        return values
+
+    def _header(self) -> list:
+        if not self.users_header:
+            self.users_header = _trim_row(self.users_ws.row_values(1))
+        return self.users_header
+
+    def users_frame(self) -> pd.DataFrame:
+        values = self._read_users()
+        if not values:
+            return normalize_users(pd.DataFrame())
+        rows = [gspread.utils.numericise_all(r) for r in values[1:]]
+        return normalize_users(pd.DataFrame(gspread.utils.to_records(values[0], rows)))
+
+    def weights_frame(self) -> pd.DataFrame:
+        return self.weights.refresh()
+
+    def revision(self, table: str):
+        # 更新時刻が前回と同じなら、どのシートも変わっていない（weights の定期的な全件読み直しを除く）
+        # 変わっていたら users: 内容のハッシュ（小さい表なので読む。weights の追記だけなら同じ値）
+        #                 weights: 末尾の差分。増えていなければ途中の行の修正として全件読み直す
+        #                          （自分が users に書いた分で更新時刻が動いたときは除く）
+        stamp = None if self.spreadsheet is None else self.spreadsheet.get_lastUpdateTime()
+        seen = self.seen.get(table)
+        if (stamp is not None and seen is not None and seen[0] == stamp
+                and not (table == "weights" and self.weights.resync_due())):
+            return seen[1]
+        if table == "users":
+            rev = hash(tuple(tuple(r) for r in self.users_ws.get(pad_values=True)))
+        else:
+            changed = stamp is not None and seen is not None and seen[0] != stamp and not self.users_written
+            self.users_written = False
+            rev = self.weights.revision(changed)
+        self.seen[table] = (stamp, rev)
+        return rev
+
+    def release(self):
+        # 差分同期用の表ごと捨てる（次は全件読み込み）
+        self.weights = WeightsSync(self.weights_ws)
+        self.seen = {}
+
+    def append_user(self, record: dict) -> Future:
+        return self.writer.submit(("append", self.users_ws, [[record.get(h, "") for h in self._header()]]))
+
+    def update_user_field(self, user_id: str, field: str, value) -> Future:
+        if field not in self._header():
+            raise KeyError(field)
+        return self.writer.submit(("update", self.users_ws, (user_id, field, value)))
+
+    def append_weights(self, rows: list) -> Future:
+        return self.writer.submit(("append", self.weights_ws, rows))
+
+    def _flush(self, batch):
+        # 追記はシートごとに append_rows 1 回（users を先に。作成直後の更新も同じ回で届く）
+        # 一括インポートなどで大きくなったら WRITE_MAX_ROWS 行ずつに分ける
+        for ws in (self.users_ws, self.weights_ws):
+            items = [(op, f) for op, f in batch if op[0] == "append" and op[1] is ws]
+            while items:
+                group, n = [], 0
+                while items and (not group or n + len(items[0][0][2]) <= WRITE_MAX_ROWS):
+                    group.append(items.pop(0))
+                    n += len(group[-1][0][2])
+                _settle([f for _, f in group],
+                        lambda: ws.append_rows([r for op, _ in group for r in op[2]]))
+                if ws is self.users_ws and group[0][1].exception() is None:
+                    self.users_written = True
+        # セル更新は users を 1 回読んで行を引き当て、batch_update 1 回
+        updates = [(op, f) for op, f in batch if op[0] == "update"]
+        if not updates:
+            return
+        try:
+            values = with_backoff(self._read_users)
+        except Exception as e:
+            for _, f in updates:
+                f.set_exception(e)
+            return
+        header = self.users_header
+        col = header.index("user_id") if "user_id" in header else None
+        rows = {}      # user_id → シート上の行番号（重複時は先頭）
+        for i, r in enumerate(values[1:]):
+            if col is not None and col < len(r):
+                rows.setdefault(normalize_uid(gspread.utils.numericise(r[col])), i + 2)
+        data, futs = [], []
+        for (_, _, (user_id, field, value)), f in updates:
+            if user_id not in rows or field not in header:
+                f.set_exception(LookupError(f"{user_id}/{field}"))
+                continue
+            a1 = gspread.utils.rowcol_to_a1(rows[user_id], header.index(field) + 1)
+            data.append({"range": a1, "values": [[value]]})
+            futs.append(f)
+        if data:
+            _settle(futs, lambda: self.users_ws.batch_update(data))
+            self.users_written = self.users_written or futs[0].exception() is None
+
+# 認証済みクライアントはサービスアカウントごとに 1 つをプロセスで共有する（テナントが増えても認証は 1 回）
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+def shared_client(svc_json) -> gspread.Client:
+    key = (svc_json.get("client_email"), svc_json.get("private_key_id"))
+    with _clients_lock:
+        if key not in _clients:
+            from oauth2client.service_account import ServiceAccountCredentials
+            scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+            credentials = ServiceAccountCredentials.from_json_keyfile_dict(svc_json, scope)
+            _clients[key] = gspread.authorize(credentials)
+        return _clients[key]
+
+def open_sheets(svc_json, spreadsheet_url: str) -> SheetsBackend:
+    sh = shared_client(svc_json).open_by_url(spreadsheet_url)
+    return SheetsBackend(InstrumentedWorksheet(sh.worksheet("users")),
+                         InstrumentedWorksheet(sh.worksheet("weights")),
+                         InstrumentedWorksheet(sh, name="spreadsheet"))
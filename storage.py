@@ -0,0 +1,365 @@
+# ===== ストレージ層（共通インターフェース / ローカル SQLite）=====
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import pandas as pd
+
+import frames
+
+log = logging.getLogger(__name__)
+
+USER_COLUMNS = ["user_id", "password_hash", "plain_password", "height_cm"]
+WEIGHT_COLUMNS = ["year", "month", "day", "user_id", "weight"]
+
+# --------------------------------
+# 正規化（どのバックエンドでも同じ形の DataFrame を返す）
+# --------------------------------
+def normalize_uid(s: str) -> str:
+    return str(s).replace("\u3000"," ").replace("\n"," ").replace("\r"," ").strip()
+
+def normalize_users(u: pd.DataFrame) -> pd.DataFrame:
+    if u.empty:
+        return pd.DataFrame(columns=USER_COLUMNS)
+    # 互換: plain_password 無い既存表でも列を用意しておく
+    if "plain_password" not in u.columns:
+        u["plain_password"] = ""
+    if "height_cm" not in u.columns:
+        u["height_cm"] = None
+    u["user_id"] = u["user_id"].map(normalize_uid)
+    # 数値
+    u["height_cm"] = pd.to_numeric(u["height_cm"], errors="coerce")
+    return u
+
+def uid_categories(s: pd.Series) -> pd.Categorical:
+    """user_id 列を正規化してカテゴリに（正規化は ID の種類ごとに 1 回だけ）。"""
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    norm_codes, cats = pd.factorize(pd.Index([normalize_uid(v) for v in uniques], dtype=object))
+    return pd.Categorical.from_codes(norm_codes[codes], categories=cats.astype(str))
+
+def normalize_weights(df: pd.DataFrame) -> pd.DataFrame:
+    """シート/DB の行（WEIGHT_COLUMNS）→ user_id（category）, date, weight（float32）だけの表。"""
+    if df.empty:
+        return frames.empty_weights()
+    out = pd.DataFrame({
+        "user_id": uid_categories(df["user_id"]),
+        "date": frames.assemble_dates(df["year"], df["month"], df["day"]),
+        "weight": frames.to_numbers(df["weight"]).astype("float32"),
+    }, index=df.index)
+    return out.dropna(subset=["date","weight"]).sort_values("date", kind="stable")
+
+# --------------------------------
+# バックエンド共通インターフェース
+# --------------------------------
+class StaleRead(Exception):
+    """保存先から読めず、手元の内容（frame）で代わりに返した読み込み。"""
+
+    def __init__(self, frame: pd.DataFrame, cause: Exception):
+        super().__init__(str(cause))
+        self.frame = frame
+        self.cause = cause
+
+class StorageBackend:
+    """app.py のデータ関数が使う読み書きの窓口。
+    読み込みは正規化済み DataFrame、書き込みは 1 件単位で、保存完了で終わる Future を返す。
+    保存先から読めず手元の内容で代用したときは、その内容を持たせた StaleRead を投げる。"""
+
+    def users_frame(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def weights_frame(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def append_user(self, record: dict) -> Future:
+        raise NotImplementedError
+
+    def update_user_field(self, user_id: str, field: str, value) -> Future:
+        """列が無ければ KeyError。該当ユーザーが無ければ Future が LookupError で終わる。"""
+        raise NotImplementedError
+
+    def append_weights(self, rows: list) -> Future:
+        """rows: [[year, month, day, user_id, weight], ...]"""
+        raise NotImplementedError
+
+    def append_weight(self, y: int, m: int, d: int, user_id: str, weight: float) -> Future:
+        return self.append_weights([[int(y), int(m), int(d), user_id, weight]])
+
+    def release(self):
+        """読み込み用に抱えているデータを手放す（書き込み待ちはそのまま）。"""
+
+    def revision(self, table: str):
+        """table（"users" / "weights"）の版を安く取る（シートの行数など）。変われば読み直す。
+        取れないバックエンドは None（TTL ごとに全件読み直す）。"""
+        return None
+
+    def ready(self) -> bool:
+        """保存先につながっているか（つながっていなくても読み書きはできる）。"""
+        return True
+
+    def sync_status(self):
+        """未送信の書き込みがあるバックエンドは {"pending": 件数, "error": 最後の失敗} を返す。"""
+        return None
+
+# --------------------------------
+# プロセス共有キャッシュ（表ごとに独立して更新・破棄する）
+# --------------------------------
+DATASET_MAX_AGE_SEC = 1800     # 版が変わらなくても、この間隔で 1 度は全件読み直す（取りこぼし対策）
+
+class RevisionProbe:
+    """版の取得（fetch）を interval 秒に 1 回だけ呼ぶ（表ごとに 1 つ）。
+    取得に失敗したら前回の値を返す（つながらない間に読み直しても同じ内容なので）。"""
+
+    def __init__(self, fetch, interval: float):
+        self.fetch = fetch
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.value = None
+        self.checked_at = 0.0
+
+    def __call__(self):
+        with self.lock:
+            if time.time() - self.checked_at >= self.interval:
+                try:
+                    self.value = self.fetch()
+                except Exception as e:
+                    log.warning("revision check failed: %s", e)
+                self.checked_at = time.time()
+            return self.value
+
+class DatasetCache:
+    """users / weights 1 表ぶんのプロセス共有キャッシュ。返す DataFrame は読み取り専用。
+    version は内容ハッシュなので、TTL で読み直しても中身が同じなら変わらない。
+    期限切れを同時に見たセッションは lock で待ち合わせ、取得は 1 回にまとめる。
+    probe（データの版を返す関数）があれば、期限切れでも版が前回と同じなら読み直さない。"""
+
+    def __init__(self, load, ttl: float, probe=None, max_age: float = DATASET_MAX_AGE_SEC):
+        self.load = load
+        self.ttl = ttl
+        self.probe = probe
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.frame = None
+        self.version = 0
+        self.revision = None
+        self.loaded_at = 0.0           # 全件読み込み
+        self.checked_at = 0.0          # 最後に新しさを確かめた時刻（TTL はここから）
+        self.hits = self.misses = 0
+
+    def _fresh(self) -> bool:
+        return self.frame is not None and time.time() - self.checked_at < self.ttl
+
+    def _unchanged(self, rev) -> bool:
+        return (rev is not None and rev == self.revision and self.frame is not None
+                and time.time() - self.loaded_at < self.max_age)
+
+    def get(self, count: bool = True) -> pd.DataFrame:
+        """count=False は版を確かめるだけの呼び出し（命中数に数えない。読み直しは misses に数える）。"""
+        if not self._fresh():
+            with self.lock:
+                if not self._fresh():
+                    rev = self.probe() if self.probe is not None else None
+                    if self._unchanged(rev):
+                        self.checked_at = time.time()
+                    else:
+                        # 版は読み込みの前に取る（読み込み中の変更は次の確認で拾う）
+                        self.misses += 1
+                        try:
+                            self.frame = self.load()
+                        except StaleRead as e:
+                            # 代わりの内容は使うが、版は覚えない（次の確認で必ず読み直す）
+                            self.frame, rev = e.frame, None
+                        self.version = frames.frame_version(self.frame)
+                        self.revision = rev
+                        self.loaded_at = self.checked_at = time.time()
+                        return self.frame
+        self.hits += count
+        return self.frame
+
+    def patch(self, fn):
+        """書き込み後、手元の表だけ fn(frame) で差し替える（再取得なし・TTL はそのまま）。
+        version が変わるので、同じプロセスの他のセッションにもそのまま見える。"""
+        with self.lock:
+            if self.frame is not None:
+                self.frame = fn(self.frame)
+                self.version = frames.frame_version(self.frame)
+
+    def invalidate(self):
+        """次の get で必ず全件読み直す。"""
+        with self.lock:
+            self.checked_at = 0.0
+            self.revision = None
+
+    def drop(self):
+        """表そのものを手放す（メモリ節約。次の get で読み直す）。"""
+        with self.lock:
+            self.frame = None
+            self.checked_at = 0.0
+            self.revision = None
+
+# --------------------------------
+# ローカル SQLite バックエンド（Sheets へは非同期で複製）
+# --------------------------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL DEFAULT '',
+    plain_password TEXT NOT NULL DEFAULT '',
+    height_cm REAL
+);
+CREATE TABLE IF NOT EXISTS weights (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    year INTEGER, month INTEGER, day INTEGER,
+    user_id TEXT, weight REAL
+);
+"""
+
+def gather(futures) -> Future:
+    """すべて終わったら終わる Future（どれかが失敗したらその例外）。"""
+    out, futures = Future(), list(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            out.set_exception(errors[0]) if errors else out.set_result(True)
+
+    if not futures:
+        out.set_result(True)
+    for f in futures:
+        f.add_done_callback(done)
+    return out
+
+def _done(value=True) -> Future:
+    fut = Future()
+    fut.set_result(value)
+    return fut
+
+class SQLiteBackend(StorageBackend):
+    """読み込みはローカル DB から即答。replica（SheetsBackend）があれば
+    起動時にシートから取り込み、以後の書き込みはシート側の書き込みキューへ流す。
+    書き込みの Future はローカル DB への保存で完了する。"""
+
+    def __init__(self, path: str = ":memory:", replica: StorageBackend = None):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.executescript(SQLITE_SCHEMA)
+        self.replica = replica
+        # シートにつながらなければ（途中で読めなくなっても）、前回までのローカル DB のまま起動する
+        if replica is not None and replica.ready():
+            try:
+                self.load_from(replica)
+            except StaleRead as e:
+                log.warning("replica unreadable (%s); keeping the local DB", e)
+
+    def load_from(self, src: StorageBackend):
+        u = src.users_frame()
+        w = src.weights_frame()
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM users")
+            self.conn.execute("DELETE FROM weights")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, password_hash, plain_password, height_cm) VALUES (?,?,?,?)",
+                [(r.user_id, str(r.password_hash), str(r.plain_password),
+                  None if pd.isna(r.height_cm) else float(r.height_cm))
+                 for r in u[USER_COLUMNS].itertuples(index=False)],
+            )
+            if not w.empty:
+                self.conn.executemany(
+                    "INSERT INTO weights (year, month, day, user_id, weight) VALUES (?,?,?,?,?)",
+                    [(r.date.year, r.date.month, r.date.day, str(r.user_id), r.weight)
+                     for r in w.assign(weight=frames.weight_floats(w["weight"])).sort_index().itertuples(index=False)],
+                )
+
+    def _replicate(self, method: str, *args):
+        if self.replica is None:
+            return
+        try:
+            fut = getattr(self.replica, method)(*args)
+        except Exception:
+            log.exception("replica %s failed", method)
+            return
+        fut.add_done_callback(
+            lambda f: f.exception() and log.error("replica %s failed: %s", method, f.exception()))
+
+    def sync_status(self):
+        return None if self.replica is None else self.replica.sync_status()
+
+    def revision(self, table: str):
+        # DB 全体で 1 つ。他の接続（別プロセス・手作業）がコミットしたときだけ変わる。このアプリの書き込みはキャッシュに差し込み済み
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _query(self, sql: str) -> pd.DataFrame:
+        with self.lock:
+            return pd.read_sql_query(sql, self.conn)
+
+    def users_frame(self) -> pd.DataFrame:
+        return normalize_users(self._query(f"SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY rowid"))
+
+    def weights_frame(self) -> pd.DataFrame:
+        return normalize_weights(self._query(f"SELECT {', '.join(WEIGHT_COLUMNS)} FROM weights ORDER BY id"))
+
+    def append_user(self, record: dict) -> Future:
+        h = record.get("height_cm", "")
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO users (user_id, password_hash, plain_password, height_cm) VALUES (?,?,?,?)",
+                (record["user_id"], record.get("password_hash", ""),
+                 record.get("plain_password", ""), None if h == "" else float(h)),
+            )
+        self._replicate("append_user", record)
+        return _done()
+
+    def update_user_field(self, user_id: str, field: str, value) -> Future:
+        if field not in USER_COLUMNS or field == "user_id":
+            raise KeyError(field)
+        with self.lock, self.conn:
+            found = self.conn.execute(
+                f"UPDATE users SET {field} = ? WHERE user_id = ?", (value, user_id)
+            ).rowcount > 0
+        if not found:
+            fut = Future()
+            fut.set_exception(LookupError(user_id))
+            return fut
+        self._replicate("update_user_field", user_id, field, value)
+        return _done()
+
+    def append_weights(self, rows: list) -> Future:
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO weights (year, month, day, user_id, weight) VALUES (?,?,?,?,?)",
+                [(int(y), int(m), int(d), user_id, weight) for y, m, d, user_id, weight in rows],
+            )
+        self._replicate("append_weights", rows)
+        return _done()
+
+def make_backend(conf) -> StorageBackend:
+    """STORAGE_BACKEND = "sheets"（既定）/ "sqlite" / "fake"（メモリ上のシート。FAKE_SHEET / FAKE_LATENCY_SEC）。
+    シートへの書き込みはジャーナル（JOURNAL_PATH）経由で、つながらない間はローカルに溜めて後で送る。
+    Sheets の認証情報が無ければネットワーク無しのローカル SQLite だけで動く。"""
+    from journal import JournaledBackend
+    kind = conf.get("STORAGE_BACKEND", "sheets")
+    svc_json = conf.get("GSPREAD_SERVICE_ACCOUNT_JSON")
+    url = conf.get("SPREADSHEET_URL")
+    connect = None
+    if kind == "fake":
+        from fakesheet import open_fake
+        name, latency = conf.get("FAKE_SHEET", "default"), float(conf.get("FAKE_LATENCY_SEC", 0))
+        connect = lambda: open_fake(name, latency)
+    elif svc_json and url:
+        from sheets import open_sheets    # gspread / oauth2client は Sheets を使うときだけ読み込む
+        connect = lambda: open_sheets(svc_json, url)
+    sheets = None
+    if connect is not None:
+        # 接続は最初に使うときに張る（起動時にシートが落ちていてもアプリは立ち上がる）
+        sheets = JournaledBackend(connect, conf.get("JOURNAL_PATH", "weight_tracker_journal.db"))
+    if kind in ("sheets", "fake") and sheets is not None:
+        return sheets
+    return SQLiteBackend(conf.get("SQLITE_PATH", "weight_tracker.db"), replica=sheets)
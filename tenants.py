@@ -0,0 +1,195 @@
+# ===== テナント（グループ）ごとのデータ層：1 プロセスで複数のスプレッドシートを扱う =====
+# secrets の例:
+#   [tenants.group_a]
+#   SPREADSHEET_URL = "https://docs.google.com/spreadsheets/d/..."
+#   GSPREAD_SERVICE_ACCOUNT_JSON = "..."   # シートと認証情報はグループごとに必須（別のグループのシートを開かないように）
+#   ADMIN_CODE = "..."           # グループごとに必須（無ければそのグループは管理者モード無し）
+# 最上位の設定は全テナント共通の既定値（キー "" が従来の単一グループ）。
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import frames
+import metrics
+import storage
+
+TENANT_MAX_ACTIVE = 8          # データを載せておくテナント数の上限
+TENANT_MAX_MB = 512            # 載せているデータ（DataFrame）の合計の上限
+TENANT_CHECK_SEC = 5           # メモリ量の見積もりはこの間隔で
+DATA_POLL_SEC = 10             # データの版（スプレッドシートの更新時刻など）を確かめる間隔
+
+TENANT_OWN_KEYS = ("SPREADSHEET_URL", "GSPREAD_SERVICE_ACCOUNT_JSON")   # 最上位から引き継がない
+
+def tenant_conf(conf, key: str) -> dict:
+    """最上位の設定に [tenants.<key>] を重ねた設定。SQLite・ジャーナルのファイルはテナントごとに分ける。
+    ADMIN_CODE は引き継がない（未設定のグループは管理者モード無し: None）。
+    シート（SPREADSHEET_URL・認証情報）も引き継がず、Sheets を使うグループで欠けていれば ValueError。"""
+    base = {k: v for k, v in conf.items() if k != "tenants"}
+    if not key:
+        return base
+    section = (conf.get("tenants") or {}).get(key)
+    if section is None:
+        raise KeyError(key)
+    merged = {**{k: v for k, v in base.items() if k not in TENANT_OWN_KEYS}, **dict(section)}
+    if merged.get("STORAGE_BACKEND", "sheets") == "sheets":
+        missing = [k for k in TENANT_OWN_KEYS if not merged.get(k)]
+        if missing:
+            raise ValueError(f"[tenants.{key}] に {' / '.join(missing)} がありません。")
+    merged["ADMIN_CODE"] = section.get("ADMIN_CODE") or None
+    if "SQLITE_PATH" not in section:
+        merged["SQLITE_PATH"] = f"weight_tracker_{key}.db"
+    if "JOURNAL_PATH" not in section:
+        merged["JOURNAL_PATH"] = f"weight_tracker_journal_{key}.db"
+    if "FAKE_SHEET" not in section:
+        merged["FAKE_SHEET"] = key
+    return merged
+
+def obj_bytes(obj) -> int:
+    """DataFrame・配列・文字列と、それらを持つ dict / list / オブジェクトのおおよそのメモリ量。"""
+    if obj is None:
+        return 0
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(pd.Series(obj.ravel()).memory_usage(deep=True, index=False)) if obj.dtype == object else obj.nbytes
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(obj_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(obj_bytes(v) for v in obj)
+    if hasattr(obj, "__dict__"):
+        return obj_bytes(vars(obj))
+    return sys.getsizeof(obj)
+
+class Tenant:
+    """1 グループ分のバックエンドとキャッシュ一式。"""
+
+    def __init__(self, key: str, conf: dict, backend: storage.StorageBackend):
+        self.key = key
+        self.conf = conf
+        self.backend = backend
+        name = key or "default"
+        # 版は表ごとに確かめ、変わっていなければ期限が来ても読み直さない
+        poll = float(conf.get("DATA_POLL_SEC", DATA_POLL_SEC))
+        check = metrics.timed("revision_check", lambda table: self.backend.revision(table))
+        self.users = storage.DatasetCache(metrics.timed("users_load", lambda: self.backend.users_frame()),
+                                          ttl=poll, probe=storage.RevisionProbe(lambda: check("users"), poll))
+        self.weights = storage.DatasetCache(metrics.timed("weights_load", lambda: self.backend.weights_frame()),
+                                            ttl=poll, probe=storage.RevisionProbe(lambda: check("weights"), poll))
+        metrics.REGISTRY.watch_cache(f"{name}/users", self.users)
+        metrics.REGISTRY.watch_cache(f"{name}/weights", self.weights)
+        self.aggregates = frames.WeightAggregates()
+        self.trends = analytics.TrendStore()
+        self.memo_lock = threading.Lock()
+        self.memos: dict = {}          # 名前 → OrderedDict[キー → 値]
+        self.building: dict = {}       # 組み立て中の (名前, キー) → Future
+
+    def memo(self, name: str, key, build, keep: int = 1):
+        """版ごとの派生データ（索引・最新表・図など）を名前ごとに直近 keep 件だけ持つ。
+        古い版は使わないので既定は 1 件。release でまとめて捨てる（メモリ量にも数える）。
+        同じ (name, key) を同時に求められたら、組み立ては 1 回だけで残りはその結果を待つ。"""
+        with self.memo_lock:
+            table = self.memos.get(name)
+            if table is not None and key in table:
+                table.move_to_end(key)
+                return table[key]
+            fut = self.building.get((name, key))
+            owner = fut is None
+            if owner:
+                fut = self.building[(name, key)] = Future()
+        if not owner:
+            return fut.result()
+        try:
+            value = build()      # 組み立ての中で別の memo を引くことがあるので lock の外で
+        except BaseException as e:
+            with self.memo_lock:
+                self.building.pop((name, key), None)
+            fut.set_exception(e)
+            raise
+        with self.memo_lock:
+            table = self.memos.setdefault(name, OrderedDict())
+            table[key] = value
+            while len(table) > keep:
+                table.popitem(last=False)
+            self.building.pop((name, key), None)
+        fut.set_result(value)
+        return value
+
+    @property
+    def loaded(self) -> bool:
+        return self.users.frame is not None or self.weights.frame is not None or bool(self.memos)
+
+    def memory_bytes(self) -> int:
+        with self.memo_lock:
+            memos = [list(t.values()) for t in self.memos.values()]
+        return (obj_bytes(self.users.frame) + obj_bytes(self.weights.frame)
+                + obj_bytes(self.aggregates.tables) + obj_bytes(self.trends) + obj_bytes(memos))
+
+    def release(self):
+        """読み込み済みのデータを手放す（次に使うときに読み直す）。書き込み待ちには触れない。"""
+        self.users.drop()
+        self.weights.drop()
+        self.aggregates = frames.WeightAggregates()
+        self.trends = analytics.TrendStore()
+        with self.memo_lock:
+            self.memos = {}
+        self.backend.release()
+
+class TenantPool:
+    """テナントを必要になった時点で作り、最近使った順に並べておく。
+    データを載せたテナントが TENANT_MAX_ACTIVE 件・TENANT_MAX_MB を超えたら古いものから release する。
+    バックエンド（Sheets の書き込みキュー・SQLite 接続）は捨てないので、保存待ちの書き込みは失われない。"""
+
+    def __init__(self, conf, make_backend=storage.make_backend,
+                 max_active: int = TENANT_MAX_ACTIVE, max_mb: float = TENANT_MAX_MB):
+        self.conf = conf
+        self.make_backend = make_backend
+        self.max_active = max_active
+        self.max_bytes = max_mb * 2**20
+        self.lock = threading.Lock()
+        self.tenants: OrderedDict = OrderedDict()
+        self.checked_at = 0.0
+
+    def keys(self) -> list:
+        return [""] + sorted((self.conf.get("tenants") or {}).keys())
+
+    def get(self, key: str) -> Tenant:
+        """未知のキーは KeyError、設定が足りないグループは ValueError。"""
+        with self.lock:
+            t = self.tenants.get(key)
+            if t is None:
+                conf = tenant_conf(self.conf, key)
+                t = self.tenants[key] = Tenant(key, conf, self.make_backend(conf))
+            self.tenants.move_to_end(key)
+            now = time.time()
+            check = now - self.checked_at > TENANT_CHECK_SEC
+            if check:
+                self.checked_at = now
+                loaded = [t for t in self.tenants.values() if t.loaded]     # 古い順
+        if check:
+            # メモリ量の見積もりと release（シートへの問い合わせを含む）は lock の外で
+            self._evict(loaded)
+        return t
+
+    def _evict(self, loaded: list):
+        sizes = [t.memory_bytes() for t in loaded]
+        total = sum(sizes)
+        while len(loaded) > 1 and (len(loaded) > self.max_active or total > self.max_bytes):
+            old = loaded.pop(0)
+            total -= sizes.pop(0)
+            old.release()
+
+    def stats(self) -> list:
+        with self.lock:
+            items = list(reversed(self.tenants.items()))
+        return [{"tenant": k or "(default)", "loaded": t.loaded, "mb": t.memory_bytes() / 2**20}
+                for k, t in items]
@@ -0,0 +1,81 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import fakesheet  # noqa: E402
+import sheets  # noqa: E402
+import storage  # noqa: E402
+import tenants  # noqa: E402
+
+def make_tenant(tmp_path, name):
+    conf = {"STORAGE_BACKEND": "fake", "FAKE_SHEET": name, "DATA_POLL_SEC": 0,
+            "JOURNAL_PATH": str(tmp_path / "journal.db")}
+    sh = fakesheet.spreadsheet(name)
+    sh.users.append_rows([["u1", "", "", "170"]])
+    sh.weights.append_rows([[2026, 10, 1, "u1", 60.5], [2026, 10, 2, "u1", 60.1]])
+    return sh, tenants.Tenant("", conf, storage.make_backend(conf))
+
+def test_failed_first_load_is_retried_after_recovery(tmp_path):
+    sh, t = make_tenant(tmp_path, "degraded")
+    sh.weights.outage = True
+    assert t.weights.get().empty          # 読めない間は手元の内容（空）
+    sh.weights.outage = False
+    assert len(t.weights.get()) == 2      # 版が同じでも、つながったら読み直す
+    assert len(t.users.get()) == 1
+
+def test_failed_reload_keeps_last_frame(tmp_path):
+    sh, t = make_tenant(tmp_path, "outage")
+    assert len(t.weights.get()) == 2
+    sh.weights.append_rows([[2026, 10, 3, "u1", 59.9]])
+    sh.outage = True
+    assert len(t.weights.get()) == 2
+    sh.outage = False
+    assert len(t.weights.get()) == 3
+
+def test_weights_append_does_not_reload_users(tmp_path):
+    sh, t = make_tenant(tmp_path, "per_sheet")
+    t.users.get()
+    t.weights.get()
+    sh.weights.append_rows([[2026, 10, 3, "u1", 59.9]])
+    assert len(t.weights.get()) == 3
+    t.users.get()
+    assert (t.users.misses, t.weights.misses) == (1, 2)
+
+def test_in_place_edits_are_detected(tmp_path):
+    sh, t = make_tenant(tmp_path, "in_place")
+    t.users.get()
+    t.weights.get()
+    sh.users.batch_update([{"range": "D2", "values": [["180"]]}])
+    assert float(t.users.get()["height_cm"].iloc[0]) == 180.0
+    sh.weights.batch_update([{"range": "E2", "values": [["58.0"]]}])     # 末尾ではない行
+    assert t.weights.get()["weight"].astype(float).round(1).tolist() == [58.0, 60.1]
+
+def test_unchanged_spreadsheet_reads_no_sheet(tmp_path):
+    sh, t = make_tenant(tmp_path, "unchanged")
+    t.users.get()
+    t.weights.get()
+    before = sh.users.calls["get"] + sh.weights.calls["get"]
+    t.users.get()
+    t.weights.get()
+    assert sh.users.calls["get"] + sh.weights.calls["get"] == before
+    assert sh.users.calls["get_lastUpdateTime"] > 0
+
+def test_own_users_write_does_not_reload_weights(tmp_path):
+    sh, t = make_tenant(tmp_path, "own_write")
+    t.users.get()
+    t.weights.get()
+    sync = t.backend.remote.weights
+    generation = sync.generation
+    t.backend.update_user_field("u1", "height_cm", "171").result(timeout=5)
+    assert float(t.users.get()["height_cm"].iloc[0]) == 171.0
+    t.weights.get()
+    assert sync.generation == generation
+
+def test_weights_full_resync_picks_up_missed_edits(tmp_path):
+    sh, t = make_tenant(tmp_path, "resync")
+    t.weights.get()
+    sh.weights.values[1][4] = "58.0"        # 更新時刻に表れない変更（見落とした修正の代わり）
+    assert len(t.weights.get()) == 2 and float(t.weights.get()["weight"].iloc[0]) == 60.5
+    t.backend.remote.weights.full_at -= sheets.WEIGHTS_FULL_RESYNC_SEC + 1
+    assert float(t.weights.get()["weight"].iloc[0]) == 58.0
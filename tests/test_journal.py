@@ -0,0 +1,88 @@
+import functools
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import fakesheet  # noqa: E402
+import journal  # noqa: E402
+import sheets  # noqa: E402
+from storage import StaleRead  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def quick_sheets(monkeypatch):
+    # 再送はテストから replay() を直接呼ぶ（バックグラウンドのスレッドは動かさない）。Sheets 側の再試行も待たない
+    monkeypatch.setattr(journal.JournaledBackend, "_run", lambda self: None)
+    monkeypatch.setattr(sheets, "with_backoff", functools.partial(sheets.with_backoff, tries=1))
+    monkeypatch.setattr(sheets, "WRITE_COALESCE_SEC", 0)
+
+def make(tmp_path, name):
+    sh = fakesheet.spreadsheet(name)
+    sh.users.append_rows([["u1", "", "", "170"]])
+    sh.weights.append_rows([[2026, 10, 1, "u1", 60.5]])
+    return sh, journal.JournaledBackend(lambda: fakesheet.open_fake(name), str(tmp_path / "journal.db"))
+
+def stale(read):
+    with pytest.raises(StaleRead) as e:
+        read()
+    return e.value.frame
+
+def weight_rows(sh):
+    return sh.weights.values[1:]
+
+def test_pending_writes_are_visible_during_outage(tmp_path):
+    sh, jb = make(tmp_path, "journal_visible")
+    assert len(jb.weights_frame()) == 1 and len(jb.users_frame()) == 1
+    sh.outage = True
+    jb.append_user({"user_id": "u2", "password_hash": "h", "plain_password": "p", "height_cm": ""})
+    jb.update_user_field("u1", "height_cm", "172")
+    jb.append_weights([[2026, 10, 2, "u1", 60.1]])
+    assert not jb.replay()
+    u = stale(jb.users_frame).set_index("user_id")
+    assert list(u.index) == ["u1", "u2"] and float(u.loc["u1", "height_cm"]) == 172.0
+    w = stale(jb.weights_frame)
+    assert w["weight"].astype(float).round(1).tolist() == [60.5, 60.1]
+    assert jb.sync_status()["pending"] == 3
+
+def test_replay_lands_exactly_once_after_recovery(tmp_path, monkeypatch):
+    sh, jb = make(tmp_path, "journal_once")
+    jb.weights_frame()
+    sh.outage = True
+    first = jb.append_weights([[2026, 10, 2, "u1", 60.1]])
+    assert not jb.replay()
+    sh.outage = False
+    # 2 件目は送信が届いたのに応答が失われる（次の再送では届いているのを確かめて送らない）
+    append_rows, lost = sh.weights.append_rows, []
+    def lossy(rows, **kw):
+        append_rows(rows, **kw)
+        if not lost:
+            lost.append(rows)
+            raise ConnectionError("response lost")
+    monkeypatch.setattr(sh.weights, "append_rows", lossy)
+    assert not jb.replay()
+    assert not first.done()                   # 届いたか分からない間は待たせたまま
+    assert len(weight_rows(sh)) == 2
+    assert len(jb.weights_frame()) == 2       # 届いた分とジャーナルの分が重ならない
+    assert jb.replay()
+    assert first.result(timeout=1) is True
+    assert weight_rows(sh) == [["2026", "10", "1", "u1", "60.5"], ["2026", "10", "2", "u1", "60.1"]]
+    assert jb.sync_status()["pending"] == 0 and len(jb.weights_frame()) == 2
+
+def test_unretryable_entry_is_dropped_but_later_entries_wait(tmp_path):
+    sh, jb = make(tmp_path, "journal_drop")
+    jb.users_frame()
+    sh.weights.outage = True
+    bad = jb.update_user_field("nobody", "height_cm", "180")
+    queued = jb.append_weights([[2026, 10, 2, "u1", 60.1]])
+    behind = jb.update_user_field("ghost", "height_cm", "150")
+    assert not jb.replay()
+    assert isinstance(bad.exception(timeout=1), LookupError)
+    assert [op for _, op, _, _ in jb.journal.entries()] == ["append_weights", "update_user_field"]
+    assert not queued.done() and not behind.done()
+    sh.weights.outage = False
+    assert jb.replay()
+    assert queued.result(timeout=1) is True
+    assert isinstance(behind.exception(timeout=1), LookupError)
+    assert jb.journal.count() == 0 and len(weight_rows(sh)) == 2
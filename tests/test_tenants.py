@@ -0,0 +1,66 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import storage  # noqa: E402
+import tenants  # noqa: E402
+
+CONF = {"SPREADSHEET_URL": "https://example.invalid/top", "GSPREAD_SERVICE_ACCOUNT_JSON": "{}",
+        "ADMIN_CODE": "top", "tenants": {
+            "a": {"SPREADSHEET_URL": "https://example.invalid/a", "GSPREAD_SERVICE_ACCOUNT_JSON": "{}"},
+            "b": {"ADMIN_CODE": "b"},
+            "c": {"STORAGE_BACKEND": "sqlite"}}}
+
+def test_sheet_settings_are_not_inherited():
+    assert tenants.tenant_conf(CONF, "a")["SPREADSHEET_URL"] == "https://example.invalid/a"
+    with pytest.raises(ValueError):
+        tenants.tenant_conf(CONF, "b")
+    c = tenants.tenant_conf(CONF, "c")
+    assert "SPREADSHEET_URL" not in c and "GSPREAD_SERVICE_ACCOUNT_JSON" not in c
+    assert c["ADMIN_CODE"] is None and c["SQLITE_PATH"] == "weight_tracker_c.db"
+
+def test_concurrent_memo_builds_once(tmp_path):
+    t = tenants.Tenant("", {}, storage.SQLiteBackend(str(tmp_path / "t.db")))
+    calls = []
+    def build():
+        calls.append(1)
+        time.sleep(0.2)
+        return object()
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(t.memo("x", 1, build))) for _ in range(4)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert len(calls) == 1 and len(got) == 4 and all(g is got[0] for g in got)
+
+def test_failed_memo_build_is_retried(tmp_path):
+    t = tenants.Tenant("", {}, storage.SQLiteBackend(str(tmp_path / "t.db")))
+    with pytest.raises(RuntimeError):
+        t.memo("x", 1, lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+    assert t.memo("x", 1, lambda: 42) == 42
+
+class SlowRelease(storage.SQLiteBackend):
+    def release(self):
+        time.sleep(0.3)     # シートへの問い合わせの代わり
+
+def test_eviction_runs_outside_the_pool_lock(tmp_path, monkeypatch):
+    monkeypatch.setattr(tenants, "TENANT_CHECK_SEC", 0)
+    conf = {"STORAGE_BACKEND": "sqlite", "tenants": {"a": {}, "b": {}}}
+    pool = tenants.TenantPool(conf, make_backend=lambda c: SlowRelease(str(tmp_path / c.get("SQLITE_PATH", "t.db"))),
+                              max_active=1)
+    for key in ("", "a"):
+        pool.get(key).memo("x", 1, lambda: "loaded")
+    evicting = threading.Thread(target=pool.get, args=("b",))
+    evicting.start()
+    time.sleep(0.1)
+    started = time.time()
+    pool.get("a")           # release の最中でも待たされない
+    assert time.time() - started < 0.2
+    evicting.join()
+    assert not pool.get("").loaded
@@ -0,0 +1,77 @@
+import io
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from storage import USER_COLUMNS, WEIGHT_COLUMNS, normalize_users, normalize_weights  # noqa: E402
+from transfer import export_chunks, validate_weights, write_export  # noqa: E402
+
+def chunk(rows, columns=("year", "month", "day", "user_id", "weight")):
+    return pd.DataFrame([[str(v) for v in r] for r in rows], columns=list(columns))
+
+def reasons(rejected):
+    return rejected["理由"].tolist()
+
+def test_range_and_unknown_user():
+    valid, rejected = validate_weights(
+        chunk([[2026, 10, 1, "u1", 29.9], [2026, 10, 2, "u1", 200.5], [2026, 10, 3, "u9", 60],
+               [2026, 10, 4, "u1", "abc"], [2026, 10, 5, "u1", 30]]),
+        set(), {"u1"})
+    assert reasons(rejected) == ["体重は 30〜200 の範囲で入力してください。"] * 2 + \
+        ["未登録のユーザーです。", "体重は数値で入力してください。"]
+    assert valid["weight"].tolist() == [30.0]
+
+def test_existing_and_in_file_duplicates():
+    existing = {"u1|2026-10-01"}
+    valid, rejected = validate_weights(
+        chunk([[2026, 10, 1, "u1", 60], [2026, 10, 2, "u1", 61], [2026, 10, 2, "u1", 62]]),
+        existing, {"u1"})
+    assert reasons(rejected) == ["登録済みの日付です。", "ファイル内で重複しています。"]
+    assert valid["weight"].tolist() == [61.0]
+    assert "u1|2026-10-02" in existing
+    # 取り込んだ分は次のチャンクでは登録済み扱い
+    _, rejected = validate_weights(chunk([[2026, 10, 2, "u1", 63]]), existing, {"u1"})
+    assert reasons(rejected) == ["登録済みの日付です。"]
+
+def test_date_column_with_mixed_formats():
+    valid, rejected = validate_weights(
+        chunk([["2026-10-07", "u1", 60], ["2026/10/08", "u1", 61], ["2026/10/9", "u1", 62],
+               ["not a date", "u1", 63]], columns=("date", "user_id", "weight")),
+        set(), {"u1"})
+    assert valid["date"].dt.strftime("%Y-%m-%d").tolist() == ["2026-10-07", "2026-10-08", "2026-10-09"]
+    assert reasons(rejected) == ["日付が不正です。"]
+
+def test_default_user_without_user_id_column():
+    valid, rejected = validate_weights(chunk([[2026, 10, 1, 60]], columns=("year", "month", "day", "weight")),
+                                       set(), {"u1"}, default_user="u1")
+    assert rejected.empty and valid["user_id"].astype(str).tolist() == ["u1"]
+
+# ---- エクスポート ----
+def export_frames():
+    dfu = normalize_users(pd.DataFrame([["u1", "$2b$12$secrethash", "secretplain", "170"],
+                                        ["u2", "$2b$12$otherhash", "", "160"]], columns=USER_COLUMNS))
+    dfw = normalize_weights(pd.DataFrame([[2026, 10, d, u, 60 + d] for d in (1, 2, 3) for u in ("u1", "u2")],
+                                         columns=WEIGHT_COLUMNS))
+    return dfw, dfu
+
+def test_export_chunks_leave_out_passwords():
+    dfw, dfu = export_frames()
+    parts = list(export_chunks(dfw, dfu, chunk_rows=4))
+    assert [len(p) for p in parts] == [4, 2]
+    for p in parts:
+        assert list(p.columns) == ["user_id", "date", "weight", "height_cm", "bmi"]
+
+def test_write_export_csv_and_parquet_have_no_password_columns():
+    dfw, dfu = export_frames()
+    raw = write_export(export_chunks(dfw, dfu, chunk_rows=4), "csv").read()
+    assert b"secret" not in raw and b"password" not in raw
+    csv = pd.read_csv(io.BytesIO(raw), encoding="utf-8-sig")
+    assert list(csv.columns) == ["user_id", "date", "weight", "height_cm", "bmi"] and len(csv) == 6
+
+    out = write_export(export_chunks(dfw, dfu, ["u1"], chunk_rows=2), "parquet")
+    pq = pd.read_parquet(out)
+    assert list(pq.columns) == ["user_id", "date", "weight", "height_cm", "bmi"]
+    assert set(pq["user_id"]) == {"u1"} and len(pq) == 3
@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fakesheet import MemoryWorksheet  # noqa: E402
+from sheets import WeightsSync  # noqa: E402
+from storage import WEIGHT_COLUMNS  # noqa: E402
+
+ROWS = [["2026", "10", "1", "u1", "60.5"], ["2026", "10", "2", "u2", "70"], ["2026", "10", "3", "u1", "60.1"]]
+
+def sheet(rows=ROWS):
+    return MemoryWorksheet([WEIGHT_COLUMNS] + rows, "weights")
+
+def test_append_reads_only_the_tail():
+    ws = sheet()
+    sync = WeightsSync(ws)
+    assert len(sync.refresh()) == 3
+    ws.append_rows([["2026", "10", "4", "u2", "69.5"]])
+    before = ws.calls["get"]
+    got = sync.refresh()
+    assert ws.calls["get"] == before + 1
+    assert got.equals(WeightsSync(ws).refresh())
+    assert sync.n_rows == 4 and sync.last_row == ["2026", "10", "4", "u2", "69.5"]
+
+def test_truncation_reloads_everything():
+    ws = sheet()
+    sync = WeightsSync(ws)
+    sync.refresh()
+    del ws.values[-2:]
+    got = sync.refresh()
+    assert len(got) == 1 and sync.n_rows == 1
+
+def test_last_row_edit_reloads_everything():
+    ws = sheet()
+    sync = WeightsSync(ws)
+    sync.refresh()
+    ws.values[-1][4] = "59.0"
+    got = sync.refresh()
+    assert len(got) == 3
+    assert float(got["weight"].iloc[-1]) == 59.0
+
+def test_empty_sheet_then_rows():
+    ws = MemoryWorksheet([], "weights")
+    sync = WeightsSync(ws)
+    assert sync.refresh().empty
+    ws.append_rows([WEIGHT_COLUMNS])
+    assert sync.refresh().empty
+    ws.append_rows(ROWS[:1])
+    got = sync.refresh()
+    assert len(got) == 1 and got["user_id"].iloc[0] == "u1"
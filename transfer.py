@@ -0,0 +1,145 @@
+# ===== 一括インポート / エクスポート（チャンク単位で流す）=====
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import frames
+from storage import normalize_uid
+
+IMPORT_CHUNK_ROWS = 5000
+
+# --------------------------------
+# 読み込み（ファイル全体をメモリに載せず、チャンクごとに返す）
+# --------------------------------
+def _csv_chunks(file, chunksize: int, encoding: str):
+    size = getattr(file, "size", 0)
+    for chunk in pd.read_csv(file, chunksize=chunksize, dtype=str,
+                             encoding=encoding, skipinitialspace=True):
+        yield chunk, (min(file.tell() / size, 1.0) if size else 0.0)
+
+def _excel_chunks(file, chunksize: int):
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = ["" if h is None else str(h).strip() for h in next(rows, ())]
+        total = max(ws.max_row or 1, 1)
+        buf, done = [], 1
+        for r in rows:
+            buf.append(r)
+            done += 1
+            if len(buf) >= chunksize:
+                yield pd.DataFrame(buf, columns=header), min(done / total, 1.0)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=header), 1.0
+    finally:
+        wb.close()
+
+def iter_chunks(file, name: str, chunksize: int = IMPORT_CHUNK_ROWS, encoding: str = "utf-8-sig"):
+    """(chunk, 進捗 0〜1) を順に返す。.xlsx 以外は CSV として読む。"""
+    if name.lower().endswith(".xlsx"):
+        yield from _excel_chunks(file, chunksize)
+    else:
+        yield from _csv_chunks(file, chunksize, encoding)
+
+# --------------------------------
+# 検証（add_weight_row と同じ規則をベクトル演算で）
+# --------------------------------
+def weight_keys(dfw: pd.DataFrame) -> pd.Series:
+    """重複判定用の (user_id, 日付) キー。"""
+    return dfw["user_id"].astype(str) + "|" + dfw["date"].dt.strftime("%Y-%m-%d")
+
+def validate_weights(chunk: pd.DataFrame, existing: set, known_users: set, default_user: str = ""):
+    """(登録できる行, 弾いた行) を返す。登録できる行は normalize_weights 済みの形。
+    existing には登録済みの weight_keys を渡す（取り込んだ分はここに足していく）。"""
+    cols = {str(c).strip().lower(): c for c in chunk.columns}
+    if {"year", "month", "day"} <= cols.keys():
+        date = frames.assemble_dates(*(chunk[cols[k]] for k in ("year", "month", "day")))
+    elif "date" in cols:
+        # 2026-10-07 と 2026/10/07 が混ざっていても、それぞれの書式で読む
+        date = pd.to_datetime(chunk[cols["date"]], errors="coerce", format="mixed").dt.normalize()
+    else:
+        raise ValueError("year / month / day 列、または date 列が必要です。")
+
+    if "user_id" in cols:
+        uid = chunk[cols["user_id"]].fillna("").map(normalize_uid)
+    else:
+        uid = pd.Series(normalize_uid(default_user), index=chunk.index)
+    weight = pd.to_numeric(chunk[cols["weight"]], errors="coerce") if "weight" in cols \
+        else pd.Series(np.nan, index=chunk.index)
+
+    key = uid + "|" + date.dt.strftime("%Y-%m-%d").fillna("")
+    reason = pd.Series(np.select(
+        [uid == "", ~uid.isin(known_users), date.isna(), weight.isna(),
+         ~weight.between(30, 200), key.isin(existing)],
+        ["user_id がありません。", "未登録のユーザーです。", "日付が不正です。",
+         "体重は数値で入力してください。", "体重は 30〜200 の範囲で入力してください。",
+         "登録済みの日付です。"],
+        default="",
+    ), index=chunk.index)
+    # ファイル内の重複は、ほかの検証を通った行の中で 2 件目以降を弾く
+    dup = (reason == "") & key.where(reason == "").duplicated()
+    reason = reason.mask(dup, "ファイル内で重複しています。")
+
+    ok = reason == ""
+    existing.update(key[ok])
+    valid = pd.DataFrame({
+        "user_id": uid[ok].astype("category"), "date": date[ok].astype("datetime64[ns]"),
+        "weight": weight[ok].astype("float32"),
+    })
+    rejected = chunk[~ok].assign(理由=reason[~ok])
+    return valid, rejected
+
+def to_sheet_rows(valid: pd.DataFrame) -> list:
+    """backend.append_weights 用の素の Python 値の行（[year, month, day, user_id, weight]）。"""
+    d = valid["date"].dt
+    return [list(r) for r in zip(d.year.tolist(), d.month.tolist(), d.day.tolist(),
+                                 valid["user_id"].astype(str).tolist(), frames.weight_floats(valid["weight"]).tolist())]
+
+# --------------------------------
+# エクスポート（キャッシュ済みの表から。パスワード列は持ち出さない）
+# --------------------------------
+EXPORT_CHUNK_ROWS = 50_000
+
+def export_chunks(dfw: pd.DataFrame, dfu: pd.DataFrame, user_ids=None, since=None, until=None,
+                  chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """user_id, date, weight, height_cm, bmi の行をチャンクで返す。
+    users からは height_cm だけを結合する（password_hash / plain_password は含めない）。"""
+    mask = pd.Series(True, index=dfw.index)
+    if user_ids:
+        mask &= dfw["user_id"].isin(user_ids)
+    if since is not None:
+        mask &= dfw["date"] >= pd.Timestamp(since)
+    if until is not None:
+        mask &= dfw["date"] <= pd.Timestamp(until)
+    w = dfw.loc[mask, ["user_id", "date", "weight"]]
+    heights = dfu.drop_duplicates("user_id").set_index("user_id")["height_cm"]
+    for i in range(0, max(len(w), 1), chunk_rows):
+        part = w.iloc[i:i + chunk_rows]
+        h = part["user_id"].map(heights).astype(float)
+        yield part.assign(user_id=part["user_id"].astype(str), weight=frames.weight_floats(part["weight"]), height_cm=h,
+                          bmi=frames.bmi_values(part["weight"], h).round(1))
+
+def write_export(chunks, fmt: str):
+    """チャンクを一時ファイルへ順に書き出し、先頭に戻したファイルを返す（fmt: "csv" / "parquet"）。"""
+    out = tempfile.TemporaryFile()
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for part in chunks:
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    else:
+        for i, part in enumerate(chunks):
+            # 先頭だけ BOM 付き（Excel で文字化けしないように）
+            out.write(part.to_csv(index=False, header=(i == 0)).encode("utf-8-sig" if i == 0 else "utf-8"))
+    out.seek(0)
+    return out